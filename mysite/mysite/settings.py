@@ -19,10 +19,40 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_WORKER_MAX_MEMORY_PER_CHILD = 500000  # 500MB
 CELERY_TASK_PROTOCOL = 2
 CELERY_ACKS_LATE = True
+# Страховочный разбор outbox индекса, если задача после коммита потерялась
+CELERY_BEAT_SCHEDULE = {
+    'drain-index-changes': {
+        'task': 'pharmacies.tasks.drain_index_changes',
+        'schedule': 30.0,
+    },
+}
 
 ELASTICSEARCH_HOSTS = ["http://elasticsearch-node-1:9200"]
 ELASTICSEARCH_USERNAME = os.getenv("ELASTIC_USER")
 ELASTICSEARCH_PASSWORD = os.getenv("ELASTIC_PASSWORD")
+# Клиент pharmacies.elastic: пул соединений на узел — не меньше потоков процесса
+# (gunicorn --threads, concurrency Celery) плюс потоки отправки bulk при переиндексации
+ELASTICSEARCH_MAXSIZE = int(os.getenv('ELASTICSEARCH_MAXSIZE', '25'))
+# Таймауты (секунды): поиск, bulk и остальные операции
+ELASTICSEARCH_SEARCH_TIMEOUT = float(os.getenv('ELASTICSEARCH_SEARCH_TIMEOUT', '3'))
+ELASTICSEARCH_BULK_TIMEOUT = float(os.getenv('ELASTICSEARCH_BULK_TIMEOUT', '120'))
+ELASTICSEARCH_TIMEOUT = float(os.getenv('ELASTICSEARCH_TIMEOUT', '30'))
+# Предохранитель: после стольких ошибок соединения подряд запросы не отправляются
+# ELASTICSEARCH_BREAKER_RESET секунд
+ELASTICSEARCH_BREAKER_THRESHOLD = int(os.getenv('ELASTICSEARCH_BREAKER_THRESHOLD', '5'))
+ELASTICSEARCH_BREAKER_RESET = float(os.getenv('ELASTICSEARCH_BREAKER_RESET', '30'))
+
+# Индекс синхронизируется через outbox (pharmacies.tasks.drain_index_changes),
+# встроенная построчная синхронизация django_elasticsearch_dsl отключена
+ELASTICSEARCH_DSL_AUTOSYNC = False
+# Не чаще одного разбора outbox за это число секунд
+INDEX_SYNC_DEBOUNCE = float(os.getenv('INDEX_SYNC_DEBOUNCE', '2'))
+# interval — видимость изменений даёт refresh_interval индекса,
+# debounced — плюс один отложенный refresh на серию записей
+INDEX_REFRESH_POLICY = os.getenv('INDEX_REFRESH_POLICY', 'debounced')
+INDEX_REFRESH_DEBOUNCE = float(os.getenv('INDEX_REFRESH_DEBOUNCE', '5'))
+# Ограничение скорости update_by_query при смене данных аптеки (документов в секунду)
+PHARMACY_UPDATE_RPS = int(os.getenv('PHARMACY_UPDATE_RPS', '2000'))
 
 ELASTICSEARCH_DSL = {
     "default": {
@@ -98,6 +128,27 @@ DATABASES = {
     }
 }
 
+# Кэш результатов поиска (pharmacies.result_cache): время жизни записи и задержка
+# повторного сброса после загрузки — за это время изменения доходят до индекса
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '300'))
+SEARCH_CACHE_INDEX_LAG = float(os.getenv('SEARCH_CACHE_INDEX_LAG', '30'))
+
+# Аптек на товар в выдаче search_products (top_hits; не больше index.max_inner_result_window,
+# по умолчанию 100). Остальные аптеки — по ссылке на постраничный список предложений
+SEARCH_PHARMACIES_PER_PRODUCT = int(os.getenv('SEARCH_PHARMACIES_PER_PRODUCT', '100'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL', 'redis://:password@redis:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # Недоступный Redis не роняет страницы, кэш просто пропускается
+            'IGNORE_EXCEPTIONS': True,
+        },
+    }
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -126,6 +177,16 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
 
+# Общий том temp_csv (web и celery_worker): загрузки CSV сохраняются сюда,
+# а в брокер уходит только путь к файлу
+CSV_UPLOAD_DIR = os.getenv('CSV_UPLOAD_DIR', os.path.join(os.path.dirname(BASE_DIR), 'temp_csv'))
+CSV_STAGED_UPLOADS = os.getenv('CSV_STAGED_UPLOADS', 'True') == 'True'
+# replace — удалить и вставить всё заново, reconcile — записать только разницу,
+# shadow — загрузить теневое поколение и переключить аптеку короткой транзакцией
+CSV_SYNC_MODE = os.getenv('CSV_SYNC_MODE', 'replace')
+# orm — bulk_create, copy — COPY FROM STDIN через временную таблицу
+CSV_LOADER = os.getenv('CSV_LOADER', 'orm')
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
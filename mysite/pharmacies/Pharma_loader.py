@@ -1,31 +1,36 @@
-import csv
-from datetime import datetime
-from .models import Product, Pharmacy
+import uuid
 
-def import_csv_to_db(csv_file_path, pharmacy_name, city, address):
+from django.db import transaction
+
+from .inventory import InventoryChanges, record_index_changes
+from .loaders import load_products
+from .models import Pharmacy
+from .signals import suppress_index_signals
+from .uploads import iter_csv_file_rows
+
+
+def import_csv_to_db(csv_file_path, pharmacy_name, city, address, workers=1):
+    """
+    Дозагружает товары из CSV через общий конвейер разбора и COPY.
+    Новые строки попадают в outbox индекса в той же транзакции — индекс
+    обновляется только для этой аптеки, без полной переиндексации.
+    """
     pharmacy, created = Pharmacy.objects.get_or_create(name=pharmacy_name, city=city, address=address)
 
-    with open(csv_file_path, newline='', encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile, delimiter=';')
-        for row in reader:
-            Product.objects.create(
-                name=row[0],
-                manufacturer=row[1],
-                country=row[2],
-                serial=row[3],
-                price=float(row[4]),
-                quantity=float(row[5]),
-                total_price=float(row[6]),
-                expiry_date=datetime.strptime(row[7], '%d.%m.%Y').date(),
-                category=row[8],
-                import_date=datetime.strptime(row[9], '%d.%m.%Y').date(),
-                internal_code=row[10],
-                wholesale_price=float(row[11]),
-                retail_price=float(row[12]),
-                distributor=row[13],
-                internal_id=row[14],
-                pharmacy=pharmacy
-            )
+    changes = InventoryChanges()
+
+    def with_uuid(rows):
+        for values in rows:
+            values = dict(values, uuid=uuid.uuid4())
+            changes.created.append(values['uuid'])
+            yield values
+
+    with suppress_index_signals(), transaction.atomic():
+        rows = iter_csv_file_rows(csv_file_path, encoding='utf-8', workers=workers)
+        count = load_products(pharmacy, with_uuid(rows), loader='copy')
+        record_index_changes(changes)
+
+    return count
 
 from django.core.management.base import BaseCommand
 
@@ -15,20 +15,16 @@ class PharmacyAdmin(admin.ModelAdmin):
     list_editable = ['city', 'address', 'phone', 'opening_hours']
     list_display_links = ['name', 'pharmacy_number']
 
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        from .tasks import update_pharmacy_city_in_index
-        update_pharmacy_city_in_index.delay(
-            obj.name, str(obj.pharmacy_number)
-        )
+    # Индекс обновляет сигнал post_save аптеки (один раз на изменение)
 
     def delete_model(self, request, obj):
-        product_uuids = list(
-        obj.products.values_list('uuid', flat=True).iterator(chunk_size=2000)
-        )
-        super().delete_model(request, obj)
-        from .tasks import remove_products_from_index
-        remove_products_from_index.delay(product_uuids)
+        from .inventory import delete_pharmacy
+        delete_pharmacy(obj)
+
+    def delete_queryset(self, request, queryset):
+        from .inventory import delete_pharmacy
+        for pharmacy in queryset:
+            delete_pharmacy(pharmacy)
 
 
 @admin.register(Product)
@@ -42,13 +38,4 @@ class ProductAdmin(admin.ModelAdmin):
         'serial', 'price', 'quantity'
     ]
     search_fields = ['name']
-
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        from .tasks import update_elasticsearch_index
-        update_elasticsearch_index.delay()
-
-    def delete_model(self, request, obj):
-        super().delete_model(request, obj)
-        from .tasks import update_elasticsearch_index
-        update_elasticsearch_index.delay()
+    # Индекс обновляют сигналы Product через outbox, отдельные задачи не нужны
@@ -6,6 +6,8 @@ app_name = 'subjects'
 
 urlpatterns = [
     path('check_status/<str:task_id>/', views.check_processing_status, name='check_status'),
+    path('ingest_stats/', views.ingest_stats, name='ingest_stats'),
+    path('search_cache_stats/', views.search_cache_stats, name='search_cache_stats'),
     path('<str:pharmacy_name>/<int:pharmacy_number>/', views.upload_csv, name='upload_csv'),
    
 ]
@@ -1,13 +1,19 @@
 
+import contextlib
 import csv
-import re
+import hashlib
 import logging
-from datetime import datetime
+import os
+import uuid
+from datetime import timedelta
 from io import StringIO
 
 import chardet
 from celery import shared_task
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.http import JsonResponse
 from elasticsearch import helpers
 from django.core.files.storage import default_storage
@@ -18,13 +24,24 @@ from rest_framework.permissions import AllowAny
 from django.views.decorators.csrf import csrf_exempt
 from pharmacies.api.serializers import ProductSerializer
 from pharmacies.documents import ProductDocument
-from pharmacies.models import Product, Pharmacy, CsvProcessingTask
-from pharmacies.tasks import remove_products_from_index, es_client, update_pharmacy_city_in_index
+from pharmacies.inventory import (
+    resolve_pharmacy, replace_products, reconcile_products, shadow_load_products,
+    record_index_changes, schedule_generation_purge
+)
+from pharmacies.loaders import LOADERS
+from pharmacies.metrics import IngestMetrics, summarize_tasks
+from pharmacies.models import Product, CsvProcessingTask
+from pharmacies.normalization import CSV_FIELDNAMES, iter_normalized_rows
+from pharmacies.search_index import ensure_index, refresh_kwargs, changes_applied
+from pharmacies.signals import suppress_index_signals
+from pharmacies.elastic import get_client
+from pharmacies.result_cache import invalidate_city, stats as result_cache_stats
+from pharmacies.uploads import stage_upload, verify_staged, iter_csv_file_rows, discard_staged
 logger = logging.getLogger(__name__)
 
 
 class ProductListView(generics.ListAPIView):
-    queryset = Product.objects.all()[:20]
+    queryset = Product.objects.live()[:20]
     serializer_class = ProductSerializer
 
 
@@ -33,49 +50,31 @@ class ProductDetailView(generics.RetrieveAPIView):
     serializer_class = ProductSerializer
 
 
-def convert_date_format(date_string):
-    try:
-        return datetime.strptime(date_string, '%d.%m.%Y').strftime('%Y-%m-%d')
-    except ValueError:
-        raise ValueError(f"Invalid date format: {date_string}")
-
-
-
-
-def parse_product_details(product_string):
-    form_keywords = [
-        'АМП', 'ТАБЛ', 'ТАБЛ.', 'ТАБЛ,', 'ТАБЛ', 'ТАБЛ.П/О', 'ТАБЛ.РАСТВ.', 'МАЗЬ',
-        'СУПП', 'ГЕЛЬ', 'КАПЛИ', 'ФЛ', 'Р-Р', 'ТУБА', 'капс',  'уп', 'паста',
-        'пак', 'пак.,', 'пак.', 'пор', 'пор.', 'жев.табл', 'жев.табл.', 'фильтр-пакет',
-        'фильтр-пакет,', 'табл.шип', 'ТАБЛ.РАССАС', 'конт', 'крем', 'табл.жев',
-        'драже', 'ф-кап', 'линим', 'капс.рект', 'фл.,', 'супп.ваг', 'саше', 'пастилки',
-    ]
-
-    if not product_string:
-        return "-", "-"
-
-    # Регулярное выражение для поиска формы (ключевое слово + остаток строки)
-    form_regex = re.compile(
-        r'(' + '|'.join(re.escape(kw) for kw in form_keywords) + r')([\s\.,].*)?$',
-        re.IGNORECASE
-    )
-
-    match = form_regex.search(product_string)
-    if match:
-        form_start = match.start()
-        name_part = product_string[:form_start].strip()  # Часть до формы
-        form_part = product_string[form_start:].strip()  # Форма и всё после неё
-
-        # Удаляем лишние пробелы/знаки препинания в начале формы
-        form_part = re.sub(r'^[\s\.,]+', '', form_part)
-
-        # Если name_part пусто (например, строка начинается с формы), возвращаем "-" для названия
-        return (name_part if name_part else "-", form_part)
-
-    # Если форма не найдена, возвращаем исходную строку как название, а форму как "-"
-    return (product_string, "-")
-
-
+SYNC_MODES = ('replace', 'reconcile', 'shadow')
+INGEST_METRIC_FIELDS = (
+    'rows_read', 'rows_inserted', 'rows_updated', 'rows_deleted', 'rows_skipped', 'rows_failed',
+    'bytes_processed', 'phases', 'wall_time', 'rows_per_sec', 'written_per_sec',
+)
+# Сколько последних загрузок учитывать в сводке
+INGEST_STATS_LIMIT = 5000
+# soft_time_limit process_csv_task: незавершённая загрузка старше него уже не закончится
+CSV_TASK_TIME_LIMIT = 3600
+
+
+def _previous_upload(pharmacy_name, pharmacy_number, checksum):
+    """
+    Последняя успешная или ещё идущая загрузка аптеки, если у неё тот же хеш
+    содержимого. Упавшие не в счёт: после них в базе остаются прежние остатки;
+    pending/processing старше лимита задачи — зависшие, тоже не в счёт.
+    """
+    in_flight_since = timezone.now() - timedelta(seconds=CSV_TASK_TIME_LIMIT)
+    last = CsvProcessingTask.objects.filter(
+        Q(status='completed') | Q(status__in=['pending', 'processing'], created_at__gte=in_flight_since),
+        pharmacy_name=pharmacy_name, pharmacy_number=str(pharmacy_number),
+    ).order_by('-created_at').first()
+    if last and last.checksum == checksum:
+        return last
+    return None
 
 
 @api_view(['POST'])
@@ -86,22 +85,83 @@ def upload_csv(request, pharmacy_name, pharmacy_number):
         if 'file' not in request.FILES:
             return JsonResponse({"error": "No file uploaded"}, status=400)
 
+        mode = request.query_params.get('mode', settings.CSV_SYNC_MODE)
+        if mode not in SYNC_MODES:
+            return JsonResponse({"error": f"Unknown mode: {mode}"}, status=400)
+        loader = request.query_params.get('loader', settings.CSV_LOADER)
+        if loader not in LOADERS:
+            return JsonResponse({"error": f"Unknown loader: {loader}"}, status=400)
+
+        # ?force=1 — обработать файл, даже если он совпадает с прошлой загрузкой
+        force = request.query_params.get('force', '').lower() in ('1', 'true', 'yes')
+
         file = request.FILES['file']
         if not file.name.lower().endswith('.csv'):
             return JsonResponse({"error": "Only CSV files allowed"}, status=400)
 
-        raw_content = file.read()
-        encoding = chardet.detect(raw_content)['encoding'] or 'utf-8'
+        if settings.CSV_STAGED_UPLOADS:
+            # Файл пишется на общий том, в брокер уходит только ссылка на него
+            staged = stage_upload(file)
+            checksum = staged.checksum
+            task_kwargs = {
+                'file_path': staged.path,
+                'checksum': checksum,
+                'encoding': staged.encoding,
+            }
+        else:
+            staged = None
+            raw_content = file.read()
+            checksum = hashlib.sha256(raw_content).hexdigest()
+            encoding = chardet.detect(raw_content)['encoding'] or 'utf-8'
+            task_kwargs = {
+                'file_content': raw_content.decode(encoding),
+                'checksum': checksum,
+            }
 
-        task = process_csv_task.delay(
-            file_content=raw_content.decode(encoding),
+        previous = None if force else _previous_upload(pharmacy_name, pharmacy_number, checksum)
+        if previous:
+            # Тот же файл уже загружен (или загружается) — задачу не ставим
+            if staged:
+                discard_staged(staged.path)
+            return JsonResponse({
+                "message": "File is identical to the previous upload",
+                "task_id": previous.task_id,
+                "status": "unchanged" if previous.status == 'completed' else previous.status,
+                "result": previous.result,
+            }, status=200)
+
+        # Запись создаётся до постановки задачи, чтобы повторная отправка сразу её видела
+        task_id = str(uuid.uuid4())
+        CsvProcessingTask.objects.create(
+            task_id=task_id,
             pharmacy_name=pharmacy_name,
-            pharmacy_number=pharmacy_number
+            pharmacy_number=pharmacy_number,
+            status='pending',
+            checksum=checksum,
         )
+        try:
+            process_csv_task.apply_async(
+                kwargs=dict(
+                    task_kwargs,
+                    pharmacy_name=pharmacy_name,
+                    pharmacy_number=pharmacy_number,
+                    mode=mode,
+                    loader=loader,
+                ),
+                task_id=task_id,
+            )
+        except Exception as e:
+            # Задача не поставлена: запись не должна выглядеть идущей загрузкой
+            CsvProcessingTask.objects.filter(task_id=task_id).update(
+                status='failed', result={'error': f"Enqueue failed: {e}"}
+            )
+            if staged:
+                discard_staged(staged.path)
+            raise
 
         return JsonResponse({
             "message": "File processing started",
-            "task_id": task.id,
+            "task_id": task_id,
             "status": "processing"
         }, status=202)
 
@@ -109,11 +169,8 @@ def upload_csv(request, pharmacy_name, pharmacy_number):
         logger.error(f"Upload error: {str(e)}", exc_info=True)
         return JsonResponse({"error": str(e)}, status=500)
 
-def bulk_delete_elasticsearch(product_uuids):
-    if not es_client:
-        logger.error("Elasticsearch client not available")
-        return "Elasticsearch client not available"
-    es = es_client
+def bulk_delete_elasticsearch(product_uuids, wait_for=False):
+    es = get_client()
     index_name = ProductDocument.Index.name
     if not product_uuids or not es.ping():
         return {"status": "skipped", "reason": "No data or ES unavailable"}
@@ -126,171 +183,108 @@ def bulk_delete_elasticsearch(product_uuids):
             }
             for uuid in product_uuids
         )
-        helpers.bulk(es, actions, chunk_size=3000, request_timeout=60)
-        # refresh только если были действия
-        if product_uuids:
-            es.indices.refresh(index=index_name)
+        helpers.bulk(es, actions, chunk_size=3000, request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT, **refresh_kwargs(wait_for))
+        changes_applied(wait_for)
         return {"status": "success", "count": len(product_uuids)}
     except Exception as e:
         logger.error(f"Bulk delete error: {str(e)}")
         return {"status": "failed", "error": str(e)}
 
-@shared_task(bind=True, max_retries=3, soft_time_limit=3600)
-def process_csv_task(self, file_content, pharmacy_name, pharmacy_number):
-    task_record, created = CsvProcessingTask.objects.update_or_create(
-        task_id=self.request.id,
-        defaults={
+@shared_task(bind=True, max_retries=3, soft_time_limit=CSV_TASK_TIME_LIMIT)
+def process_csv_task(self, file_content=None, pharmacy_name=None, pharmacy_number=None,
+                     file_path=None, checksum=None, encoding='utf-8', mode='replace',
+                     loader='orm'):
+    defaults = {
         'pharmacy_name': pharmacy_name,
         'pharmacy_number': pharmacy_number,
         'status': 'processing'
     }
+    if checksum:
+        defaults['checksum'] = checksum
+    task_record, created = CsvProcessingTask.objects.update_or_create(
+        task_id=self.request.id,
+        defaults=defaults
     )
 
+    metrics = IngestMetrics()
+    metrics.extra.update({'mode': mode, 'loader': loader})
+
     try:
-        pharmacy_map = {
-            'novamedika': 'Новамедика',
-            'ekliniya': 'Эклиния'
-        }
-        normalized_name = pharmacy_map.get(pharmacy_name.lower())
-        if not normalized_name:
-            raise ValueError(f"Invalid pharmacy: {pharmacy_name}")
-
-        # Определяем город для аптеки (можно доработать под ваши правила)
-        city_map = {
-            'Новамедика': 'Минск',
-            'Эклиния': 'Минск',
-        }
-        current_city = city_map.get(normalized_name, 'Минск')
-
-        with transaction.atomic():
-            # Проверяем, есть ли аптека
-            existing_pharmacy = Pharmacy.objects.filter(
-                name=normalized_name,
-                pharmacy_number=str(pharmacy_number)
-            ).first()
-
-            if existing_pharmacy:
-                # Если city пустое, обновим его
-                if not existing_pharmacy.city or existing_pharmacy.city.strip() == '':
-                    existing_pharmacy.city = current_city
-                    existing_pharmacy.save(update_fields=['city'])
-                pharmacy = existing_pharmacy
-                created = False
+        if file_path:
+            with metrics.phase('decode'):
+                resolved_path = verify_staged(file_path, checksum)
+            metrics.counters['bytes_processed'] = os.path.getsize(resolved_path)
+        else:
+            metrics.counters['bytes_processed'] = len(file_content.encode('utf-8'))
+        metrics.save(self.request.id)
+
+        # shadow пишет вне общей транзакции: в ней только переключение поколения
+        with contextlib.nullcontext() if mode == 'shadow' else transaction.atomic():
+            pharmacy = resolve_pharmacy(pharmacy_name, pharmacy_number)
+
+            # Парсинг CSV в одном процессе: дочерний процесс prefork-воркера — демон
+            # и пул процессов завести не может, загрузки параллелит concurrency воркера.
+            # Разбор в несколько процессов есть только у команды import_csv_to_db
+            if file_path:
+                rows = iter_csv_file_rows(resolved_path, encoding=encoding, stats=metrics.counters)
             else:
-                # Создаем новую аптеку с городом
-                pharmacy = Pharmacy.objects.create(
-                    name=normalized_name,
-                    pharmacy_number=str(pharmacy_number),
-                    city=current_city
-                )
-                created = True
-
-            # Удаляем старые товары
-            existing_products = Product.objects.filter(pharmacy=pharmacy)
-            product_uuids_to_delete = list(existing_products.values_list('uuid', flat=True))
-            if product_uuids_to_delete:
-                # Разбиваем на чанки и отправляем асинхронные задачи
-                chunk_size = 1000
-                for i in range(0, len(product_uuids_to_delete), chunk_size):
-                    chunk = product_uuids_to_delete[i:i + chunk_size]
-                    remove_products_from_index.delay(chunk)
-
-            existing_products.delete()
-
-            # Парсинг CSV
-            fieldnames = [
-                'name', 'manufacturer', 'country', 'serial', 'price', 'quantity',
-                'total_price', 'expiry_date', 'category', 'import_date',
-                'internal_code', 'wholesale_price', 'retail_price',
-                'distributor', 'internal_id', 'pharmacy_number'
-            ]
-
-            reader = csv.DictReader(StringIO(file_content), fieldnames=fieldnames, delimiter=';')
-            batch_size = 1000
-            products_batch = []
-            created_count = 0
-            processed_products = set()
-
-            for row in reader:
-                try:
-                    if not any(row.values()):
-                        logger.warning(f"Row: {row}", exc_info=True)
-                        continue
-                    # Нормализация данных
-                    product_name = row['name']
-                    product_form = '-'
-                    if row['category'] == 'Лексредства':
-                        product_name, product_form = parse_product_details(row['name'])
-                    serial = re.sub(r'[\s\-_]+', '', row['serial']).upper()
-                    expiry_date = convert_date_format(row['expiry_date'])
-                    import_date = convert_date_format(row['import_date'])
-                    # Пропускаем дубликаты в CSV
-                    product_key = (product_name, serial, expiry_date)
-                    if product_key in processed_products:
-                        continue
-                    processed_products.add(product_key)
-                    product = Product(
-                        pharmacy=pharmacy,
-                        name=product_name,
-                        form=product_form,
-                        manufacturer=(row['manufacturer'] or '').strip(),
-                        country=(row['country'] or '').strip(),
-                        serial=serial,
-                        price=float(row['price'].replace(',', '.')) if row['price'] else 0.0,
-                        quantity=float(row['quantity'].replace(',', '.')) if row['quantity'] else 0.0,
-                        expiry_date=expiry_date,
-                        category=row['category'],
-                        import_date=import_date,
-                        internal_code=row['internal_code'],
-                        wholesale_price=float(row['wholesale_price'].replace(',', '.')) if row['wholesale_price'] else None,
-                        retail_price=float(row['retail_price'].replace(',', '.')) if row['retail_price'] else None,
-                        distributor=(row['distributor'] or '').strip(),
-                        internal_id=row['internal_id']
-                    )
-                    products_batch.append(product)
-                    created_count += 1
-                    # Сохраняем батч
-                    if len(products_batch) >= batch_size:
-                        Product.objects.bulk_create(products_batch, ignore_conflicts=True)
-                        products_batch = []
-                except Exception as e:
-                    # Можно добавить лог ошибок по строкам
-                    logger.error(f"Error processing row: {e}")
-
-            # Сохраняем остаток
-            if products_batch:
-                Product.objects.bulk_create(products_batch, ignore_conflicts=True)
-
-            # Обновляем индекс в Elasticsearch
-            from pharmacies.tasks import bulk_update_elasticsearch
-            product_uuids_qs = Product.objects.filter(pharmacy=pharmacy).values_list('uuid', flat=True)
-            batch = []
-            for uuid in product_uuids_qs.iterator(chunk_size=2000):
-                batch.append(uuid)
-                if len(batch) >= 1000:
-                    bulk_update_elasticsearch.delay(batch.copy())
-                    batch = []
-            if batch:
-                bulk_update_elasticsearch.delay(batch)
+                reader = csv.DictReader(StringIO(file_content), fieldnames=CSV_FIELDNAMES, delimiter=';')
+                rows = iter_normalized_rows(reader, stats=metrics.counters)
+            rows = metrics.timed_rows(rows)
+
+            def record_outbox(changes):
+                with metrics.phase('index_fanout'):
+                    record_index_changes(changes)
+
+            # Изменения индекса пишутся в outbox одним пакетом в той же транзакции,
+            # построчные сигналы удаления/вставки не нужны
+            with metrics.phase('db_write'), suppress_index_signals():
+                if mode == 'reconcile':
+                    # Пишем только разницу с текущими остатками аптеки
+                    changes = reconcile_products(pharmacy, rows, loader=loader)
+                    record_outbox(changes)
+                elif mode == 'shadow':
+                    changes = shadow_load_products(pharmacy, rows, loader=loader, on_flip=record_outbox)
+                else:
+                    changes = replace_products(pharmacy, rows, loader=loader)
+                    record_outbox(changes)
+            # Разбор и запись outbox идут внутри db_write (строки читаются по мере записи)
+            metrics.phases['db_write'] -= metrics.phases['parse'] + metrics.phases['index_fanout']
+
+        metrics.counters['rows_inserted'] = len(changes.created)
+        metrics.counters['rows_updated'] = len(changes.updated)
+        metrics.counters['rows_deleted'] = changes.deleted_count
+        metrics.extra['unchanged'] = changes.unchanged
+        metrics.save(self.request.id)
+
+        if mode == 'shadow':
+            schedule_generation_purge(pharmacy)
+        # Закэшированные результаты поиска по городу аптеки больше не актуальны
+        invalidate_city(pharmacy.city)
+        metrics.save(self.request.id, status='completed')
+        return metrics.as_dict()
     except Exception as e:
         logger.error(f"Error in process_csv_task: {e}", exc_info=True)
-        CsvProcessingTask.objects.filter(task_id=self.request.id).update(status='failed', result=str(e))
+        metrics.extra['error'] = str(e)
+        metrics.save(self.request.id, status='failed')
         raise
+    finally:
+        if file_path:
+            discard_staged(file_path)
 
 
 @shared_task
-def bulk_update_elasticsearch(product_uuids):
-    es = es_client
+def bulk_update_elasticsearch(product_uuids, wait_for=False):
+    es = get_client()
     index_name = ProductDocument.Index.name
 
     if not product_uuids or not es.ping():
         return {"status": "skipped", "reason": "No data or ES unavailable"}
 
-    if not es.indices.exists(index=index_name):
-        ProductDocument.init(using=es)
+    ensure_index(es)
 
     # Используем Product.objects.filter для оптимизации запроса
-    products = Product.objects.filter(uuid__in=product_uuids).select_related('pharmacy')
+    products = Product.objects.live().filter(uuid__in=product_uuids).select_related('pharmacy')
 
     actions = (
         {
@@ -303,8 +297,8 @@ def bulk_update_elasticsearch(product_uuids):
     )
 
     try:
-        helpers.bulk(es, actions, chunk_size=3000, request_timeout=60)
-        es.indices.refresh(index=index_name)
+        helpers.bulk(es, actions, chunk_size=3000, request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT, **refresh_kwargs(wait_for))
+        changes_applied(wait_for)
         return {"status": "success", "count": len(product_uuids)}
     except Exception as e:
         logger.error(f"Bulk index error: {str(e)}")
@@ -316,11 +310,38 @@ def bulk_update_elasticsearch(product_uuids):
 def check_processing_status(request, task_id):
     try:
         task = CsvProcessingTask.objects.get(task_id=task_id)
+        result = task.result if isinstance(task.result, dict) else {}
         return JsonResponse({
             'status': task.status,
             'result': task.result,
+            'metrics': {key: result[key] for key in INGEST_METRIC_FIELDS if key in result},
             'created_at': task.created_at,
             'updated_at': task.updated_at
         })
     except CsvProcessingTask.DoesNotExist:
         return JsonResponse({'error': 'Task not found'}, status=404)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def ingest_stats(request):
+    """Сводка метрик загрузок за последние ?days= дней по аптекам и по дням"""
+    try:
+        days = min(max(int(request.GET.get('days', 7)), 1), 90)
+    except ValueError:
+        return JsonResponse({'error': 'days must be an integer'}, status=400)
+
+    since = timezone.now() - timedelta(days=days)
+    tasks = CsvProcessingTask.objects.filter(
+        created_at__gte=since, status__in=['completed', 'failed']
+    ).order_by('-created_at').values(
+        'pharmacy_name', 'pharmacy_number', 'status', 'result', 'created_at'
+    )[:INGEST_STATS_LIMIT]
+    return JsonResponse({'days': days, **summarize_tasks(tasks)})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_cache_stats(request):
+    """Попадания и промахи кэша результатов поиска по страницам"""
+    return JsonResponse(result_cache_stats())
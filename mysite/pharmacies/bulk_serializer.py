@@ -0,0 +1,151 @@
+"""
+Быстрая сериализация товаров для bulk-запросов Elasticsearch: кортежи из
+values_list вместо экземпляров Product, кэш документа аптеки и готовое
+NDJSON-тело запроса вместо списка действий для helpers.bulk.
+"""
+import json
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+from .documents import product_key
+from .models import Pharmacy
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него — стандартный json
+    orjson = None
+
+# Порядок колонок values_list: uuid, pharmacy_id, затем поля документа
+TEXT_FIELDS = ('name', 'form', 'manufacturer', 'country')
+NUMERIC_FIELDS = ('price', 'quantity', 'total_price', 'wholesale_price', 'retail_price')
+PRODUCT_COLUMNS = ('uuid', 'pharmacy_id') + TEXT_FIELDS + NUMERIC_FIELDS
+
+CHUNK_SIZE = 2000
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value)
+else:
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def pharmacy_document(pharmacy_id, name, pharmacy_number, city):
+    """Вложенный документ аптеки — как в ProductDocument.to_dict"""
+    return {
+        "id": str(pharmacy_id),
+        "name": name or "",
+        "pharmacy_number": str(pharmacy_number) if pharmacy_number is not None else "",
+        "city": city or "",
+    }
+
+
+class PharmacyDocuments:
+    """Закодированные документы аптек по id: один запрос на аптеку за всю заливку"""
+
+    def __init__(self, pharmacies=None):
+        self._encoded = {}
+        for pharmacy in pharmacies or ():
+            self.add(pharmacy.uuid, pharmacy.name, pharmacy.pharmacy_number, pharmacy.city)
+
+    def add(self, pharmacy_id, name, pharmacy_number, city):
+        self._encoded[pharmacy_id] = dumps(pharmacy_document(pharmacy_id, name, pharmacy_number, city))
+
+    def __getitem__(self, pharmacy_id):
+        encoded = self._encoded.get(pharmacy_id)
+        if encoded is None:
+            values = Pharmacy.objects.filter(uuid=pharmacy_id).values_list(
+                'name', 'pharmacy_number', 'city'
+            ).first() or (None, None, None)
+            self.add(pharmacy_id, *values)
+            encoded = self._encoded[pharmacy_id]
+        return encoded
+
+
+def encode_source(row, pharmacies):
+    """Тело документа из кортежа PRODUCT_COLUMNS; аптека вклеивается уже закодированной"""
+    _, pharmacy_id, name, form, manufacturer, country, price, quantity, total_price, wholesale, retail = row
+    body = dumps({
+        "name": name,
+        "form": form,
+        "manufacturer": manufacturer,
+        "country": country,
+        "product_key": product_key(name, form, manufacturer, country),
+        "price": float(price) if price is not None else 0.0,
+        "quantity": float(quantity) if quantity is not None else 0.0,
+        "total_price": float(total_price) if total_price is not None else 0.0,
+        "wholesale_price": float(wholesale) if wholesale is not None else 0.0,
+        "retail_price": float(retail) if retail is not None else 0.0,
+    })
+    return body[:-1] + b',"pharmacy":' + pharmacies[pharmacy_id] + b'}'
+
+
+def ndjson_chunks(rows, index_names, pharmacies, chunk_size=CHUNK_SIZE):
+    """
+    Готовые тела bulk-запросов по chunk_size товаров (на каждый индекс из index_names).
+    Отдаёт (тело, число документов, uuid последнего товара).
+    """
+    headers = [b'{"index":{"_index":' + dumps(name) + b',"_id":"' for name in index_names]
+    lines = []
+    count = 0
+    last_uuid = None
+    for row in rows:
+        last_uuid = row[0]
+        source = encode_source(row, pharmacies)
+        product_id = str(last_uuid).encode('ascii')
+        for header in headers:
+            lines.append(header + product_id + b'"}}\n' + source + b'\n')
+        count += 1
+        if count == chunk_size:
+            yield b''.join(lines), count * len(headers), last_uuid
+            lines = []
+            count = 0
+    if lines:
+        yield b''.join(lines), count * len(headers), last_uuid
+
+
+def delete_lines(product_uuids, index_names):
+    """NDJSON для удаления документов"""
+    return b''.join(
+        b'{"delete":{"_index":' + dumps(name) + b',"_id":"' + str(product_uuid).encode('ascii') + b'"}}\n'
+        for product_uuid in product_uuids
+        for name in index_names
+    )
+
+
+def send_body(es, body, request_timeout=None, **params):
+    """Один bulk-запрос; возвращает (успешно, ошибки без 404 на удалении)"""
+    response = es.bulk(
+        body=body, request_timeout=request_timeout or settings.ELASTICSEARCH_BULK_TIMEOUT, **params
+    )
+    if not response.get('errors'):
+        return len(response['items']), []
+    errors = []
+    for item in response['items']:
+        op, result = next(iter(item.items()))
+        if result.get('status', 200) >= 300 and not (op == 'delete' and result.get('status') == 404):
+            errors.append(item)
+    return len(response['items']) - len(errors), errors
+
+
+def send_chunks(es, chunks, thread_count=4, **params):
+    """
+    Отправляет тела из ndjson_chunks в thread_count потоков. Результаты
+    приходят в исходном порядке: (успешно, ошибки, uuid последнего товара).
+    """
+    def send(chunk):
+        body, _, last_uuid = chunk
+        success, errors = send_body(es, body, **params)
+        return success, errors, last_uuid
+
+    if thread_count <= 1:
+        yield from map(send, chunks)
+        return
+    pool = ThreadPool(thread_count)
+    try:
+        yield from pool.imap(send, chunks)
+    finally:
+        pool.close()
+        pool.join()
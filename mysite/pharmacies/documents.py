@@ -1,17 +1,81 @@
 # documents.py
 from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
+from elasticsearch_dsl import analyzer, char_filter, normalizer, token_filter
 from .models import Product, Pharmacy
 
 
+# Латиница, похожая на кириллицу (в выгрузках встречается «Магне B6» с латинской B,
+# а пользователь набирает кириллицей), и ё -> е. Применяется и при индексации, и при поиске.
+CYRILLIC_FOLDING = char_filter(
+    'cyrillic_folding',
+    type='mapping',
+    mappings=[
+        'A => А', 'a => а', 'B => В', 'C => С', 'c => с', 'E => Е', 'e => е',
+        'H => Н', 'K => К', 'k => к', 'M => М', 'O => О', 'o => о', 'P => Р',
+        'p => р', 'T => Т', 'X => Х', 'x => х', 'y => у', 'Ё => Е', 'ё => е',
+    ]
+)
+
+NAME_EDGE_NGRAM = token_filter('name_edge_ngram', type='edge_ngram', min_gram=1, max_gram=20)
+NAME_TRUNCATE = token_filter('name_truncate', type='truncate', length=20)
+RUSSIAN_STOP = token_filter('russian_stop', type='stop', stopwords='_russian_')
+RUSSIAN_STEMMER = token_filter('russian_stemmer', type='stemmer', language='russian')
+
+# Целые слова без морфологии
+name_analyzer = analyzer(
+    'product_name', tokenizer='standard', char_filter=[CYRILLIC_FOLDING], filter=['lowercase']
+)
+# Префиксы строятся при индексации: набор «пара» — обычный term-запрос
+name_prefix_analyzer = analyzer(
+    'product_name_prefix', tokenizer='standard', char_filter=[CYRILLIC_FOLDING],
+    filter=['lowercase', NAME_EDGE_NGRAM]
+)
+name_prefix_search_analyzer = analyzer(
+    'product_name_prefix_search', tokenizer='standard', char_filter=[CYRILLIC_FOLDING],
+    filter=['lowercase', NAME_TRUNCATE]
+)
+name_russian_analyzer = analyzer(
+    'product_name_russian', tokenizer='standard', char_filter=[CYRILLIC_FOLDING],
+    filter=['lowercase', RUSSIAN_STOP, RUSSIAN_STEMMER]
+)
+# Ключ группировки: регистр и латиница-двойники не различаются
+product_keyword = normalizer(
+    'product_keyword', char_filter=[CYRILLIC_FOLDING], filter=['lowercase', 'trim']
+)
+
+
+def product_key(name, form, manufacturer, country):
+    """Ключ товара для группировки в product_pages: регистр и латиница-двойники снимает normalizer поля"""
+    return '|'.join(value or '' for value in (name, form, manufacturer, country))
+
+
 @registry.register_document
 class ProductDocument(Document):
     pharmacy = fields.ObjectField(properties={
+    'id': fields.KeywordField(),  # UUID аптеки — стабильный ключ для update/delete by query
     'name': fields.TextField(fields={'keyword': fields.KeywordField()}),
     'pharmacy_number': fields.KeywordField(),  # Используйте Keyword для точных совпадений
     'city': fields.KeywordField(),
 })
 
+    name = fields.TextField(
+        analyzer=name_analyzer,
+        fields={
+            'prefix': fields.TextField(
+                analyzer=name_prefix_analyzer, search_analyzer=name_prefix_search_analyzer
+            ),
+            'ru': fields.TextField(analyzer=name_russian_analyzer),
+            'keyword': fields.KeywordField(normalizer=product_keyword),
+        }
+    )
+    form = fields.TextField(
+        analyzer=name_analyzer,
+        fields={'keyword': fields.KeywordField(normalizer=product_keyword)}
+    )
+
+    product_key = fields.KeywordField(normalizer=product_keyword)
+
     price = fields.FloatField()
     quantity = fields.FloatField()
     total_price = fields.FloatField()
@@ -29,8 +93,6 @@ class ProductDocument(Document):
     class Django:
         model = Product
         fields = [
-            'name',
-            'form',
             'manufacturer',
             'country',
         ]
@@ -41,12 +103,14 @@ class ProductDocument(Document):
             "form": product.form,
             "manufacturer": product.manufacturer,
             "country": product.country,
+            "product_key": product_key(product.name, product.form, product.manufacturer, product.country),
             "price": float(product.price) if product.price is not None else 0.0,
             "quantity": float(product.quantity) if product.quantity is not None else 0.0,
             "total_price": float(product.total_price) if product.total_price is not None else 0.0,
             "wholesale_price": float(product.wholesale_price) if product.wholesale_price is not None else 0.0,
             "retail_price": float(product.retail_price) if product.retail_price is not None else 0.0,
             "pharmacy": {
+                "id": str(product.pharmacy.uuid) if product.pharmacy else "",
                 "name": product.pharmacy.name if product.pharmacy else "",
                 "pharmacy_number": str(product.pharmacy.pharmacy_number) if product.pharmacy else "",
                 "city": product.pharmacy.city if product.pharmacy else "",
@@ -55,4 +119,4 @@ class ProductDocument(Document):
 
     def get_queryset(self):
         """Overwrite to optimize database query"""
-        return super().get_queryset().select_related('pharmacy')
+        return super().get_queryset().live().select_related('pharmacy')
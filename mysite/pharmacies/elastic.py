@@ -0,0 +1,134 @@
+"""
+Общий клиент Elasticsearch для веба, Celery и команд. Создаётся при первом
+обращении (не при импорте: веб-воркер не ждёт ES на старте, а prefork-воркер
+Celery не наследует соединения родителя) и защищён предохранителем: после
+серии ошибок соединения запросы сразу падают, пока не пройдёт пауза.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from elasticsearch import Elasticsearch, Transport
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_breaker = None
+_lock = threading.Lock()
+
+
+class ElasticsearchUnavailable(ESConnectionError):
+    """Предохранитель разомкнут: запрос в ES не отправлялся"""
+
+    def __str__(self):
+        return "Elasticsearch is unavailable (circuit breaker open)"
+
+
+class CircuitBreaker:
+    """
+    Счётчик подряд идущих ошибок соединения. После threshold ошибок запросы
+    отклоняются reset_after секунд, затем пропускается один пробный: успех
+    замыкает предохранитель, ошибка снова размыкает его.
+    """
+
+    def __init__(self, threshold, reset_after):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_after
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_after:
+                return False
+            # Пробный запрос; остальные ждут его результата ещё одну паузу
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Elasticsearch circuit breaker opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+class BreakerTransport(Transport):
+    """Transport, который пропускает запросы через предохранитель процесса"""
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        breaker = get_breaker()
+        if not breaker.allow():
+            raise ElasticsearchUnavailable('N/A', 'circuit breaker open', None)
+        try:
+            response = super().perform_request(method, url, headers=headers, params=params, body=body)
+        except ESConnectionError:
+            # Сюда же попадает ConnectionTimeout
+            breaker.record_failure()
+            raise
+        except Exception:
+            # ES ответил ошибкой (4xx/5xx) — соединение живо
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return response
+
+
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        with _lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    settings.ELASTICSEARCH_BREAKER_THRESHOLD, settings.ELASTICSEARCH_BREAKER_RESET
+                )
+    return _breaker
+
+
+def get_client():
+    """Клиент процесса; создаётся при первом вызове"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                auth = None
+                if settings.ELASTICSEARCH_USERNAME:
+                    auth = (settings.ELASTICSEARCH_USERNAME, settings.ELASTICSEARCH_PASSWORD)
+                _client = Elasticsearch(
+                    hosts=settings.ELASTICSEARCH_HOSTS,
+                    http_auth=auth,
+                    transport_class=BreakerTransport,
+                    maxsize=settings.ELASTICSEARCH_MAXSIZE,
+                    timeout=settings.ELASTICSEARCH_TIMEOUT,
+                    # Повтор только на другом узле при обрыве, не при таймауте:
+                    # таймаут x повторы и держал запросы минутами
+                    max_retries=1,
+                    retry_on_timeout=False,
+                )
+    return _client
+
+
+def search(index, body, **params):
+    """Поисковый запрос с коротким таймаутом"""
+    params.setdefault('request_timeout', settings.ELASTICSEARCH_SEARCH_TIMEOUT)
+    return get_client().search(index=index, body=body, **params)
+
+
+def is_available():
+    """False, пока предохранитель разомкнут (без запроса в ES)"""
+    return not get_breaker().is_open
@@ -0,0 +1,353 @@
+import hashlib
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .loaders import load_products
+from .models import IndexChange, Pharmacy, Product
+
+# Естественный ключ товара внутри аптеки — тот же, по которому
+# отбрасываются дубликаты в CSV
+NATURAL_KEY_FIELDS = ('name', 'serial', 'expiry_date')
+
+# Поля, изменение которых означает, что строку нужно перезаписать
+FINGERPRINT_FIELDS = (
+    'form', 'manufacturer', 'country', 'price', 'quantity', 'total_price',
+    'category', 'import_date', 'internal_code', 'wholesale_price',
+    'retail_price', 'distributor', 'internal_id',
+)
+
+INDEX_CHUNK_SIZE = 1000
+
+# Размер пачки при удалении старого поколения: каждая пачка — своя короткая транзакция
+PURGE_BATCH_SIZE = 5000
+# Старое поколение удаляется после того, как индекс успеет получить новое
+PURGE_DELAY = 60
+
+
+def _canonical(field_name, value):
+    if value is None:
+        return ''
+    model_field = Product._meta.get_field(field_name)
+    decimal_places = getattr(model_field, 'decimal_places', None)
+    if decimal_places is not None:
+        # 12.5, '12.50' и Decimal('12.500') должны давать один и тот же отпечаток
+        return str(Decimal(str(value)).quantize(Decimal(1).scaleb(-decimal_places)))
+    return str(value)
+
+
+def product_fingerprint(values):
+    """Стабильный отпечаток содержимого строки (dict или экземпляр Product)"""
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name, None)
+    payload = '\x1f'.join(_canonical(name, get(name)) for name in FINGERPRINT_FIELDS)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def natural_key(values):
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name, None)
+    return tuple(str(get(name)) for name in NATURAL_KEY_FIELDS)
+
+
+def chunked(items, size=INDEX_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+@dataclass
+class InventoryChanges:
+    created: list = field(default_factory=list)
+    updated: list = field(default_factory=list)
+    deleted: list = field(default_factory=list)
+    unchanged: int = 0
+    # Аптека, товары которой удалены целиком (replace): в индексе — delete_by_query
+    cleared_pharmacy: object = None
+    cleared: int = 0
+
+    @property
+    def deleted_count(self):
+        return len(self.deleted) + self.cleared
+
+    def as_dict(self):
+        return {
+            'created': len(self.created),
+            'updated': len(self.updated),
+            'deleted': self.deleted_count,
+            'unchanged': self.unchanged,
+        }
+
+
+PHARMACY_NAMES = {
+    'novamedika': 'Новамедика',
+    'ekliniya': 'Эклиния'
+}
+
+# Определяем город для аптеки (можно доработать под ваши правила)
+PHARMACY_CITIES = {
+    'Новамедика': 'Минск',
+    'Эклиния': 'Минск',
+}
+
+
+def resolve_pharmacy(pharmacy_name, pharmacy_number):
+    """Находит аптеку по имени из URL загрузки и номеру или создаёт её с городом"""
+    normalized_name = PHARMACY_NAMES.get(pharmacy_name.lower())
+    if not normalized_name:
+        raise ValueError(f"Invalid pharmacy: {pharmacy_name}")
+    current_city = PHARMACY_CITIES.get(normalized_name, 'Минск')
+
+    # Проверяем, есть ли аптека
+    pharmacy = Pharmacy.objects.filter(
+        name=normalized_name,
+        pharmacy_number=str(pharmacy_number)
+    ).first()
+
+    if pharmacy:
+        # Если city пустое, обновим его
+        if not pharmacy.city or pharmacy.city.strip() == '':
+            pharmacy.city = current_city
+            pharmacy.save(update_fields=['city'])
+        return pharmacy
+
+    # Создаем новую аптеку с городом
+    return Pharmacy.objects.create(
+        name=normalized_name,
+        pharmacy_number=str(pharmacy_number),
+        city=current_city
+    )
+
+
+def clear_pharmacy_products(pharmacy):
+    """
+    Удаляет все товары аптеки одним DELETE, не выбирая строки в память
+    (каскад Django при подключённых сигналах загрузил бы их все).
+    Индекс не трогает — см. record_changes('pharmacy', ..., 'delete').
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {Product._meta.db_table} WHERE pharmacy_id = %s", [pharmacy.pk]
+        )
+        return cursor.rowcount
+
+
+def delete_pharmacy(pharmacy):
+    """Удаляет аптеку: товары — одним DELETE, документы в индексе — одним delete_by_query"""
+    from .signals import suppress_index_signals
+
+    with transaction.atomic(), suppress_index_signals():
+        clear_pharmacy_products(pharmacy)
+        record_changes('pharmacy', [pharmacy.pk], 'delete')
+        pharmacy.delete()
+
+
+def replace_products(pharmacy, rows, loader='orm', batch_size=1000):
+    """
+    Полная замена остатков: удалить все товары аптеки и вставить заново.
+    Возвращает InventoryChanges: старые строки сняты целиком по аптеке
+    (cleared_pharmacy), все новые UUID созданы.
+    """
+    changes = InventoryChanges()
+    changes.cleared = clear_pharmacy_products(pharmacy)
+    changes.cleared_pharmacy = pharmacy.pk
+
+    load_products(pharmacy, rows, loader=loader, batch_size=batch_size)
+
+    changes.created = list(
+        Product.objects.filter(pharmacy=pharmacy).values_list('uuid', flat=True).iterator(chunk_size=2000)
+    )
+    return changes
+
+
+def plan_reconcile(current, rows):
+    """
+    Сверка без записи в базу. current — кортежи (uuid, name, serial,
+    expiry_date, fingerprint) текущих строк аптеки, rows — нормализованные
+    строки выгрузки. Возвращает (новые строки, [(uuid, строка)] изменившихся,
+    UUID на удаление, число неизменных).
+    """
+    existing = {}
+    duplicates = []
+    for product_uuid, name, serial, expiry_date, fingerprint in current:
+        key = (str(name), str(serial), str(expiry_date))
+        if key in existing:
+            # Исторические дубликаты по ключу — оставляем одну строку
+            duplicates.append(product_uuid)
+        else:
+            existing[key] = (product_uuid, fingerprint)
+
+    to_create = []
+    to_update = []
+    seen = set()
+    unchanged = 0
+    for values in rows:
+        key = natural_key(values)
+        seen.add(key)
+        match = existing.get(key)
+        if match is None:
+            to_create.append(values)
+        elif match[1] != values['fingerprint']:
+            to_update.append((match[0], values))
+        else:
+            unchanged += 1
+
+    deleted = duplicates + [
+        product_uuid for key, (product_uuid, _) in existing.items() if key not in seen
+    ]
+    return to_create, to_update, deleted, unchanged
+
+
+def reconcile_products(pharmacy, rows, loader='orm', batch_size=1000):
+    """
+    Сверяет новые остатки с текущими по естественному ключу и отпечатку:
+    вставляет только новые строки, обновляет изменившиеся и удаляет пропавшие.
+    Возвращает InventoryChanges со списками затронутых UUID.
+    """
+    changes = InventoryChanges()
+    current = (
+        Product.objects.filter(pharmacy=pharmacy, generation=pharmacy.active_generation)
+        .values_list('uuid', 'name', 'serial', 'expiry_date', 'fingerprint')
+        .iterator(chunk_size=5000)
+    )
+    to_create, to_update, changes.deleted, changes.unchanged = plan_reconcile(current, rows)
+
+    for chunk in chunked(changes.deleted, batch_size):
+        Product.objects.filter(uuid__in=chunk).delete()
+
+    now = timezone.now()
+    updates = [
+        Product(uuid=product_uuid, pharmacy=pharmacy, updated_at=now, **values)
+        for product_uuid, values in to_update
+    ]
+    update_fields = list(FINGERPRINT_FIELDS) + ['fingerprint', 'updated_at']
+    for chunk in chunked(updates, batch_size):
+        Product.objects.bulk_update(chunk, update_fields)
+    changes.updated = [product.uuid for product in updates]
+
+    to_create = [dict(values, uuid=uuid.uuid4()) for values in to_create]
+    load_products(pharmacy, to_create, loader=loader, batch_size=batch_size)
+    changes.created = [values['uuid'] for values in to_create]
+
+    return changes
+
+
+class PharmacyLoadInProgress(RuntimeError):
+    """Аптеку уже загружает другой процесс (блокировка pharmacy_load_lock занята)"""
+
+
+@contextmanager
+def pharmacy_load_lock(pharmacy):
+    """
+    Сессионная advisory-блокировка аптеки на время теневой загрузки:
+    две загрузки одной аптеки не пишут в одно поколение.
+    """
+    key = pharmacy.pk.int >> 65  # Положительное bigint
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [key])
+        if not cursor.fetchone()[0]:
+            raise PharmacyLoadInProgress(f"Another load of pharmacy {pharmacy} is in progress")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [key])
+
+
+def purge_stale_generations(pharmacy, batch_size=PURGE_BATCH_SIZE, older_only=False):
+    """
+    Удаляет строки неактивных поколений аптеки пачками, возвращает число удалённых.
+    older_only — только поколения старше активного: строки новее может писать
+    идущая теневая загрузка.
+    """
+    from .signals import suppress_index_signals
+
+    deleted = 0
+    stale = Product.objects.filter(pharmacy=pharmacy)
+    if older_only:
+        stale = stale.filter(generation__lt=pharmacy.active_generation)
+    else:
+        stale = stale.exclude(generation=pharmacy.active_generation)
+    with suppress_index_signals():
+        while True:
+            batch = list(stale.values_list('uuid', flat=True)[:batch_size])
+            if not batch:
+                return deleted
+            Product.objects.filter(uuid__in=batch).delete()
+            deleted += len(batch)
+
+
+def shadow_load_products(pharmacy, rows, loader='orm', batch_size=1000, on_flip=None):
+    """
+    Загрузка в теневое поколение без длинной транзакции: новые строки пишутся
+    рядом с текущими и не видны в поиске, затем одной короткой транзакцией
+    аптека переключается на новое поколение. Старое поколение остаётся до
+    purge_stale_generations (см. schedule_generation_purge).
+    on_flip(changes) выполняется в транзакции переключения (запись outbox).
+    Возвращает InventoryChanges.
+    """
+    changes = InventoryChanges()
+    with pharmacy_load_lock(pharmacy):
+        # Хвосты прерванной прошлой загрузки
+        purge_stale_generations(pharmacy, batch_size=PURGE_BATCH_SIZE)
+
+        previous = pharmacy.active_generation
+        generation = previous + 1
+        load_products(pharmacy, rows, loader=loader, batch_size=batch_size, generation=generation)
+
+        changes.deleted = list(
+            Product.objects.filter(pharmacy=pharmacy, generation=previous)
+            .values_list('uuid', flat=True).iterator(chunk_size=5000)
+        )
+        changes.created = list(
+            Product.objects.filter(pharmacy=pharmacy, generation=generation)
+            .values_list('uuid', flat=True).iterator(chunk_size=5000)
+        )
+
+        with transaction.atomic():
+            if on_flip:
+                on_flip(changes)
+            # Строка аптеки блокируется последним оператором транзакции
+            flipped = Pharmacy.objects.filter(
+                pk=pharmacy.pk, active_generation=previous
+            ).update(active_generation=generation)
+            if not flipped:
+                raise RuntimeError(f"Active generation of pharmacy {pharmacy} changed during load")
+        pharmacy.active_generation = generation
+    return changes
+
+
+def schedule_generation_purge(pharmacy):
+    from .tasks import purge_stale_products
+
+    purge_stale_products.apply_async(args=[str(pharmacy.pk)], countdown=PURGE_DELAY)
+
+
+def record_changes(entity, object_ids, op, batch_size=INDEX_CHUNK_SIZE):
+    """
+    Пишет изменения в outbox IndexChange в текущей транзакции;
+    после коммита их применит drain_index_changes.
+    """
+    from .tasks import schedule_index_drain
+
+    count = 0
+    for chunk in chunked(list(object_ids), batch_size):
+        IndexChange.objects.bulk_create(
+            [IndexChange(entity=entity, object_id=object_id, op=op) for object_id in chunk]
+        )
+        count += len(chunk)
+    if count:
+        schedule_index_drain()
+    return count
+
+
+def record_index_changes(changes):
+    """
+    Outbox для InventoryChanges: очистка аптеки, новые строки, удаления.
+    Удаление по аптеке drain применяет раньше вставок из той же пачки.
+    """
+    if changes.cleared_pharmacy:
+        record_changes('pharmacy', [changes.cleared_pharmacy], 'delete')
+    record_changes('product', changes.created + changes.updated, 'upsert')
+    record_changes('product', changes.deleted, 'delete')
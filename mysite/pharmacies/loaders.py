@@ -0,0 +1,140 @@
+import uuid
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Product
+
+# orm — Product + bulk_create, copy — COPY FROM STDIN во временную таблицу
+LOADERS = ('orm', 'copy')
+
+COPY_COLUMNS = (
+    'uuid', 'name', 'form', 'manufacturer', 'country', 'serial', 'price',
+    'quantity', 'total_price', 'expiry_date', 'category', 'import_date',
+    'internal_code', 'wholesale_price', 'retail_price', 'distributor',
+    'internal_id', 'fingerprint', 'pharmacy_id', 'generation', 'updated_at',
+)
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def load_products(pharmacy, rows, loader='orm', batch_size=1000, generation=None):
+    """
+    Вставляет нормализованные строки выбранным загрузчиком, возвращает число строк.
+    generation — поколение новых строк, по умолчанию активное поколение аптеки.
+    """
+    if generation is None:
+        generation = pharmacy.active_generation
+    if loader == 'copy':
+        return copy_products(pharmacy, rows, generation=generation)
+    if loader == 'orm':
+        return bulk_create_products(pharmacy, rows, batch_size=batch_size, generation=generation)
+    raise ValueError(f"Unknown loader: {loader}")
+
+
+def bulk_create_products(pharmacy, rows, batch_size=1000, generation=0):
+    products_batch = []
+    count = 0
+    for values in rows:
+        products_batch.append(Product(pharmacy=pharmacy, generation=generation, **values))
+        count += 1
+        # Сохраняем батч
+        if len(products_batch) >= batch_size:
+            Product.objects.bulk_create(products_batch, ignore_conflicts=True)
+            products_batch = []
+
+    # Сохраняем остаток
+    if products_batch:
+        Product.objects.bulk_create(products_batch, ignore_conflicts=True)
+    return count
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+class _CopyStream:
+    """Файлоподобный объект для copy_expert поверх генератора строк"""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = b''
+        self.count = 0
+
+    def read(self, size=-1):
+        while self._lines is not None and (size < 0 or len(self._buffer) < size):
+            try:
+                self._buffer += next(self._lines)
+                self.count += 1
+            except StopIteration:
+                self._lines = None
+        if size < 0:
+            chunk, self._buffer = self._buffer, b''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def _column_defaults():
+    """
+    Умолчания модели для NOT NULL колонок COPY. Product(**values) подставляет
+    их сам, а COPY записал бы \\N и упал на NOT NULL временной таблицы.
+    """
+    defaults = {}
+    for column in COPY_COLUMNS:
+        field = Product._meta.get_field(column)
+        if column != 'uuid' and field.has_default() and not field.null:
+            defaults[column] = field.get_default()
+    return defaults
+
+
+def _copy_lines(pharmacy, rows, generation=0):
+    updated_at = timezone.now()
+    defaults = _column_defaults()
+    for values in rows:
+        record = dict(values, pharmacy_id=pharmacy.pk, generation=generation, updated_at=updated_at)
+        if record.get('uuid') is None:
+            record['uuid'] = uuid.uuid4()
+        for column, default in defaults.items():
+            if record.get(column) is None:
+                record[column] = default
+        line = '\t'.join(_copy_value(record.get(column)) for column in COPY_COLUMNS)
+        yield (line + '\n').encode('utf-8')
+
+
+def copy_products(pharmacy, rows, generation=0):
+    """
+    Потоково пишет строки через COPY ... FROM STDIN во временную таблицу
+    (временные таблицы не пишутся в WAL) и одним INSERT ... SELECT
+    переносит их в pharmacies_product.
+    """
+    table = Product._meta.db_table
+    stage = f"{table}_stage"
+    columns = ', '.join(COPY_COLUMNS)
+    stream = _CopyStream(_copy_lines(pharmacy, rows, generation=generation))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {stage}")
+        cursor.execute(
+            f"CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        cursor.copy_expert(
+            f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT text)",
+            stream,
+            size=COPY_BUFFER_SIZE,
+        )
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) "
+            f"SELECT {columns} FROM {stage} "
+            f"ON CONFLICT DO NOTHING"
+        )
+        cursor.execute(f"DROP TABLE {stage}")
+    return stream.count
@@ -0,0 +1,123 @@
+# Синтетические выгрузки аптек для команд benchmark_*
+
+import csv
+import random
+import re
+from datetime import date, timedelta
+
+DRUG_NAMES = [
+    'Парацетамол', 'Ибупрофен', 'Аспирин', 'Анальгин', 'Но-шпа', 'Цитрамон',
+    'Амоксициллин', 'Азитромицин', 'Цефтриаксон', 'Лоратадин', 'Цетиризин',
+    'Омепразол', 'Панкреатин', 'Мезим форте', 'Смекта', 'Лоперамид',
+    'Каптоприл', 'Эналаприл', 'Лизиноприл', 'Амлодипин', 'Бисопролол',
+    'Метформин', 'Глибенкламид', 'Аторвастатин', 'Розувастатин', 'Варфарин',
+    'Диклофенак', 'Кеторолак', 'Нимесулид', 'Мелоксикам', 'Пантенол',
+    'Левомеколь', 'Тетрациклин', 'Хлоргексидин', 'Мирамистин', 'Нафтизин',
+    'Ксилометазолин', 'Амброксол', 'Ацетилцистеин', 'Бромгексин', 'Валидол',
+    'Корвалол', 'Глицин', 'Магне B6', 'Витамин C', 'Аскорутин', 'Фолиевая кислота',
+    'Ферроградумет', 'Кальций-Д3', 'Регидрон', 'Активированный уголь',
+]
+
+DRUG_FORMS = [
+    'ТАБЛ. 500МГ №10', 'табл. п/о 20мг №30', 'ТАБЛ.П/О 5МГ №28', 'капс 20мг №14',
+    'капс. 250мг №16', 'АМП 2мл №5', 'Р-Р д/ин 10мг/мл 2мл №10', 'МАЗЬ 10% 25г',
+    'ГЕЛЬ 5% 50г', 'КАПЛИ назал. 0,1% 10мл', 'СУПП. рект. 100мг №10', 'ФЛ 100мл',
+    'пор. д/приг. р-ра 5г №10', 'пак. 3г №10', 'саше №20', 'сироп ФЛ 100мл',
+    'жев.табл. №20', 'табл.шип №10', 'ТАБЛ.РАССАС №24', 'крем 15г', 'драже №50',
+    'пастилки №16', 'супп.ваг №10', 'линим 25г',
+]
+
+DRUG_VARIANTS = ['', '', '', ' форте', ' ретард', ' экспресс', ' лонг', ' мини', ' junior', ' МВ']
+
+# Дозировки и фасовки, которые подставляются вместо чисел в DRUG_FORMS
+DOSES = [1, 2, 5, 10, 12, 14, 15, 16, 20, 25, 28, 30, 40, 50, 60, 100, 120, 200, 250, 400, 500, 1000]
+NUMBER_REGEX = re.compile(r'\d+')
+
+# Различных названий в синтетическом каталоге: порядок реального справочника аптечной сети
+CATALOGUE_SIZE = 30000
+
+OTHER_NAMES = [
+    'Бинт стерильный 7х14', 'Шприц 5мл', 'Пластырь бактерицидный', 'Тонометр',
+    'Термометр электронный', 'Маска медицинская', 'Перчатки нитриловые',
+    'Вата 100г', 'Соска-пустышка', 'Презервативы №3',
+]
+
+MANUFACTURERS = [
+    ('Борисовский ЗМП', 'Беларусь'), ('Белмедпрепараты', 'Беларусь'),
+    ('Фармтехнология', 'Беларусь'), ('Лекфарм', 'Беларусь'),
+    ('KRKA', 'Словения'), ('Gedeon Richter', 'Венгрия'), ('Sandoz', 'Швейцария'),
+    ('Teva', 'Израиль'), ('Фармстандарт', 'Россия'), ('Озон', 'Россия'),
+]
+
+DISTRIBUTORS = ['Фармация', 'БелАлеп', 'Бел-Фарм', 'Медикор']
+
+
+def _amount(value):
+    return f"{value:.2f}".replace('.', ',')
+
+
+def _date(value):
+    return value.strftime('%d.%m.%Y')
+
+
+def drug_catalogue(size=CATALOGUE_SIZE, seed=0):
+    """
+    Каталог из size различных названий «Препарат ФОРМА»: к базовым названиям
+    добавляются вариант препарата, дозировка и фасовка, как в реальных выгрузках
+    """
+    rng = random.Random(seed)
+    catalogue = {}
+    while len(catalogue) < size:
+        name = rng.choice(DRUG_NAMES) + rng.choice(DRUG_VARIANTS)
+        form = NUMBER_REGEX.sub(lambda match: str(rng.choice(DOSES)), rng.choice(DRUG_FORMS))
+        catalogue.setdefault(f"{name} {form}", None)
+    return list(catalogue)
+
+
+def drug_names(count, seed=0, distinct=CATALOGUE_SIZE):
+    """Названия лекарств из каталога drug_catalogue, с повторами как в реальных выгрузках"""
+    rng = random.Random(seed)
+    catalogue = drug_catalogue(distinct, seed=seed)
+    # Популярные позиции встречаются намного чаще остальных
+    weights = [1.0 / (rank + 1) for rank in range(len(catalogue))]
+    return rng.choices(catalogue, weights=weights, k=count)
+
+
+def synthetic_rows(count, seed=0):
+    """Строки CSV в формате выгрузки аптек (16 колонок через ';')"""
+    rng = random.Random(seed)
+    names = iter(drug_names(count, seed=seed))
+    today = date.today()
+    for i in range(count):
+        if rng.random() < 0.85:
+            name, category = next(names), 'Лексредства'
+        else:
+            name, category = rng.choice(OTHER_NAMES), 'Медизделия'
+        manufacturer, country = rng.choice(MANUFACTURERS)
+        price = rng.uniform(0.5, 150)
+        quantity = rng.randint(1, 40)
+        wholesale = price * 0.8
+        yield [
+            name,
+            manufacturer,
+            country,
+            f"{rng.randrange(10 ** 6):06d}-{i}",
+            _amount(price),
+            str(quantity),
+            _amount(price * quantity),
+            _date(today + timedelta(days=rng.randint(30, 1500))),
+            category,
+            _date(today - timedelta(days=rng.randint(0, 365))),
+            str(100000 + i),
+            _amount(wholesale),
+            _amount(price),
+            rng.choice(DISTRIBUTORS),
+            str(i),
+            '1',
+        ]
+
+
+def write_synthetic_csv(path, count, seed=0, encoding='cp1251'):
+    with open(path, 'w', newline='', encoding=encoding) as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerows(synthetic_rows(count, seed=seed))
@@ -0,0 +1,68 @@
+import csv
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pharmacies.loaders import LOADERS, load_products
+from pharmacies.models import Pharmacy
+from pharmacies.normalization import CSV_FIELDNAMES, iter_normalized_rows
+
+from ._synthetic import write_synthetic_csv
+
+
+class Command(BaseCommand):
+    help = "Compare rows/sec of product loaders (bulk_create vs COPY) on one CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500000)
+        parser.add_argument('--csv', dest='csv_path', help='Existing CSV export instead of a synthetic one')
+        parser.add_argument('--encoding', default='cp1251')
+        parser.add_argument('--loaders', nargs='+', choices=LOADERS, default=list(LOADERS))
+
+    def handle(self, *args, **options):
+        csv_path = options['csv_path']
+        encoding = options['encoding']
+        generated = False
+        if not csv_path:
+            fd, csv_path = tempfile.mkstemp(suffix='.csv')
+            os.close(fd)
+            self.stdout.write(f"Generating {options['rows']} synthetic rows...")
+            write_synthetic_csv(csv_path, options['rows'], encoding=encoding)
+            generated = True
+
+        def rows():
+            with open(csv_path, encoding=encoding, newline='') as f:
+                reader = csv.DictReader(f, fieldnames=CSV_FIELDNAMES, delimiter=';')
+                yield from iter_normalized_rows(reader)
+
+        try:
+            started = time.perf_counter()
+            parsed = sum(1 for _ in rows())
+            parse_time = time.perf_counter() - started
+            self.stdout.write(f"parse only: {parsed} rows in {parse_time:.2f}s ({parsed / parse_time:,.0f} rows/s)")
+
+            # Все вставки откатываются, в базе ничего не остаётся
+            with transaction.atomic():
+                pharmacy = Pharmacy(name='benchmark', pharmacy_number='0', city='benchmark')
+                Pharmacy.objects.bulk_create([pharmacy])
+
+                for loader in options['loaders']:
+                    savepoint = transaction.savepoint()
+                    started = time.perf_counter()
+                    count = load_products(pharmacy, rows(), loader=loader)
+                    elapsed = time.perf_counter() - started
+                    transaction.savepoint_rollback(savepoint)
+                    load_time = max(elapsed - parse_time, 1e-9)
+                    self.stdout.write(
+                        f"{loader:>5}: {count} rows in {elapsed:.2f}s "
+                        f"({count / elapsed:,.0f} rows/s end-to-end, "
+                        f"{count / load_time:,.0f} rows/s excluding parse)"
+                    )
+
+                transaction.set_rollback(True)
+        finally:
+            if generated:
+                os.remove(csv_path)
@@ -0,0 +1,60 @@
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacies.normalization import parse_date, parse_decimal
+
+from ._synthetic import synthetic_rows
+
+
+def reference_convert(row):
+    """Прежний путь: strptime -> strftime -> строка, float -> Decimal при сохранении"""
+    def convert_date_format(date_string):
+        return datetime.strptime(date_string, '%d.%m.%Y').strftime('%Y-%m-%d')
+
+    def to_decimal(value):
+        # Django приводит float к Decimal через строковое представление
+        return Decimal(repr(float(value.replace(',', '.')))) if value else None
+
+    return (
+        datetime.strptime(convert_date_format(row[7]), '%Y-%m-%d').date(),
+        datetime.strptime(convert_date_format(row[9]), '%Y-%m-%d').date(),
+        to_decimal(row[4]), to_decimal(row[5]), to_decimal(row[11]), to_decimal(row[12]),
+    )
+
+
+def fast_convert(row):
+    return (
+        parse_date(row[7]), parse_date(row[9]),
+        parse_decimal(row[4]), parse_decimal(row[5]), parse_decimal(row[11]), parse_decimal(row[12]),
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark date/decimal parsing of ingest rows against the strptime/float path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500000)
+
+    def handle(self, *args, **options):
+        rows = list(synthetic_rows(options['rows']))
+        self.stdout.write(f"{len(rows)} rows")
+
+        started = time.perf_counter()
+        expected = [reference_convert(row) for row in rows]
+        reference_time = time.perf_counter() - started
+
+        parse_date.cache_clear()
+        started = time.perf_counter()
+        actual = [fast_convert(row) for row in rows]
+        fast_time = time.perf_counter() - started
+
+        if expected != actual:
+            mismatches = sum(1 for old, new in zip(expected, actual) if old != new)
+            raise CommandError(f"{mismatches} rows differ from the previous conversion")
+
+        self.stdout.write(f"strptime/float: {reference_time:.3f}s")
+        self.stdout.write(f"cached/Decimal: {fast_time:.3f}s (x{reference_time / fast_time:.1f})")
+        self.stdout.write(str(parse_date.cache_info()))
@@ -0,0 +1,77 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacies.elastic import get_client
+from pharmacies.search_index import INDEX_ALIAS
+from pharmacies.search_queries import name_query
+
+from ._synthetic import DRUG_NAMES
+
+
+def legacy_name_query(text):
+    """Прежний запрос: нечёткий bool_prefix по name со стандартным анализом"""
+    return {
+        "multi_match": {
+            "query": text,
+            "fields": ["name"],
+            "type": "bool_prefix",
+            "fuzziness": "AUTO",
+            "operator": "and"
+        }
+    }
+
+
+def typeahead_queries():
+    """Набор как при вводе: префиксы названий по буквам и запросы из двух слов"""
+    queries = []
+    for name in DRUG_NAMES:
+        word = name.split()[0]
+        queries += [word[:length] for length in range(2, len(word) + 1)]
+        if ' ' in name:
+            queries.append(name)
+    return queries
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = "Benchmark typeahead latency: fuzzy bool_prefix on name vs edge-ngram/Russian subfields"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--index', default=INDEX_ALIAS)
+
+    def handle(self, *args, **options):
+        es_client = get_client()
+        index = options['index']
+        mapping = es_client.indices.get_mapping(index=index)
+        properties = next(iter(mapping.values()))['mappings']['properties']
+        if 'prefix' not in properties.get('name', {}).get('fields', {}):
+            raise CommandError(f"{index} has no name.prefix subfield, run rebuild_index first")
+
+        queries = typeahead_queries()
+        self.stdout.write(f"{len(queries)} queries x {options['rounds']} rounds against {index}")
+
+        for label, build in (('bool_prefix + fuzziness', legacy_name_query), ('edge-ngram subfields', name_query)):
+            took, wall, hits = [], [], 0
+            for _ in range(options['rounds']):
+                for text in queries:
+                    started = time.perf_counter()
+                    # request_cache выключен: сравниваем выполнение запроса, а не кэш
+                    response = es_client.search(
+                        index=index, body={"query": build(text), "size": 10},
+                        request_cache=False,
+                    )
+                    wall.append((time.perf_counter() - started) * 1000)
+                    took.append(response['took'])
+                    hits += response['hits']['total']['value']
+            self.stdout.write(
+                f"{label:<24} took p50 {statistics.median(took):.1f}ms p95 {percentile(took, 0.95):.1f}ms, "
+                f"wall p50 {statistics.median(wall):.1f}ms p95 {percentile(wall, 0.95):.1f}ms, "
+                f"hits/query {hits / len(took):,.0f}"
+            )
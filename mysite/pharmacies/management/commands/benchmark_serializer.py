@@ -0,0 +1,78 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch.serializer import JSONSerializer
+
+from pharmacies.bulk_serializer import PharmacyDocuments, ndjson_chunks, orjson
+from pharmacies.documents import ProductDocument
+from pharmacies.models import Pharmacy, Product
+from pharmacies.normalization import CSV_FIELDNAMES, normalize_row
+
+from ._synthetic import synthetic_rows
+
+PHARMACY_COUNT = 200
+
+
+def reference_bulk_body(products, index_name):
+    """Прежний путь: ProductDocument().to_dict на экземпляр и сериализация действий как в helpers.bulk"""
+    serializer = JSONSerializer()
+    lines = []
+    for product in products:
+        lines.append(serializer.dumps({"index": {"_index": index_name, "_id": str(product.uuid)}}))
+        lines.append(serializer.dumps(ProductDocument().to_dict(product)))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = "Benchmark bulk body serialization: ProductDocument.to_dict vs values_list + NDJSON encoder"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+
+    def handle(self, *args, **options):
+        pharmacies = [
+            Pharmacy(name='novamedika', pharmacy_number=str(number), city='Минск')
+            for number in range(PHARMACY_COUNT)
+        ]
+        values = []
+        for i, row in enumerate(synthetic_rows(options['rows'])):
+            normalized = normalize_row(dict(zip(CSV_FIELDNAMES, row)))
+            normalized.update(uuid=uuid.uuid4(), pharmacy=pharmacies[i % PHARMACY_COUNT])
+            values.append(normalized)
+        self.stdout.write(f"{len(values)} rows, {PHARMACY_COUNT} pharmacies, encoder: {'orjson' if orjson else 'json'}")
+
+        index_name = ProductDocument.Index.name
+        columns = ('name', 'form', 'manufacturer', 'country', 'price', 'quantity',
+                   'total_price', 'wholesale_price', 'retail_price')
+
+        # Старый путь получает экземпляры моделей, новый — кортежи values_list
+        started = time.perf_counter()
+        products = [Product(**row) for row in values]
+        reference = reference_bulk_body(products, index_name)
+        reference_time = time.perf_counter() - started
+
+        tuples = [
+            (row['uuid'], row['pharmacy'].uuid) + tuple(row.get(column) for column in columns)
+            for row in values
+        ]
+        started = time.perf_counter()
+        documents = PharmacyDocuments(pharmacies)
+        fast = b''.join(body for body, _, _ in ndjson_chunks(tuples, [index_name], documents))
+        fast_time = time.perf_counter() - started
+
+        old_lines = reference.splitlines()
+        new_lines = fast.splitlines()
+        if len(old_lines) != len(new_lines):
+            raise CommandError(f"{len(old_lines)} lines before, {len(new_lines)} after")
+        mismatches = sum(1 for old, new in zip(old_lines, new_lines) if json.loads(old) != json.loads(new))
+        if mismatches:
+            raise CommandError(f"{mismatches} NDJSON lines differ from ProductDocument.to_dict")
+
+        self.stdout.write(f"to_dict + helpers serializer: {reference_time:.2f}s ({len(values) / reference_time:,.0f} docs/s)")
+        self.stdout.write(
+            f"values_list + NDJSON:         {fast_time:.2f}s ({len(values) / fast_time:,.0f} docs/s, "
+            f"x{reference_time / fast_time:.1f})"
+        )
+        self.stdout.write(f"body size: {len(reference):,} -> {len(fast):,} bytes")
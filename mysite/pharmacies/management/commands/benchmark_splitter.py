@@ -0,0 +1,97 @@
+import csv
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacies.normalization import parse_product_details
+
+from ._synthetic import CATALOGUE_SIZE, drug_names
+
+
+def reference_parse_product_details(product_string):
+    """Прежняя реализация: список ключевых слов и регулярка собираются на каждый вызов"""
+    form_keywords = [
+        'АМП', 'ТАБЛ', 'ТАБЛ.', 'ТАБЛ,', 'ТАБЛ', 'ТАБЛ.П/О', 'ТАБЛ.РАСТВ.', 'МАЗЬ',
+        'СУПП', 'ГЕЛЬ', 'КАПЛИ', 'ФЛ', 'Р-Р', 'ТУБА', 'капс',  'уп', 'паста',
+        'пак', 'пак.,', 'пак.', 'пор', 'пор.', 'жев.табл', 'жев.табл.', 'фильтр-пакет',
+        'фильтр-пакет,', 'табл.шип', 'ТАБЛ.РАССАС', 'конт', 'крем', 'табл.жев',
+        'драже', 'ф-кап', 'линим', 'капс.рект', 'фл.,', 'супп.ваг', 'саше', 'пастилки',
+    ]
+
+    if not product_string:
+        return "-", "-"
+
+    form_regex = re.compile(
+        r'(' + '|'.join(re.escape(kw) for kw in form_keywords) + r')([\s\.,].*)?$',
+        re.IGNORECASE
+    )
+
+    match = form_regex.search(product_string)
+    if match:
+        form_start = match.start()
+        name_part = product_string[:form_start].strip()
+        form_part = product_string[form_start:].strip()
+        form_part = re.sub(r'^[\s\.,]+', '', form_part)
+        return (name_part if name_part else "-", form_part)
+
+    return (product_string, "-")
+
+
+def hit_ratio(info, before=None):
+    """Доля попаданий в lru_cache между двумя cache_info()"""
+    hits = info.hits - (before.hits if before else 0)
+    misses = info.misses - (before.misses if before else 0)
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+class Command(BaseCommand):
+    help = "Benchmark the product name/form splitter against the previous implementation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000)
+        parser.add_argument('--distinct', type=int, default=CATALOGUE_SIZE, help='Size of the synthetic catalogue')
+        parser.add_argument('--csv', dest='csv_path', help='Take names from a real CSV export')
+        parser.add_argument('--encoding', default='cp1251')
+
+    def handle(self, *args, **options):
+        if options['csv_path']:
+            with open(options['csv_path'], encoding=options['encoding'], newline='') as f:
+                names = [row[0] for row in csv.reader(f, delimiter=';') if row]
+        else:
+            names = drug_names(options['rows'], distinct=options['distinct'])
+        self.stdout.write(f"{len(names)} names, {len(set(names))} distinct")
+
+        started = time.perf_counter()
+        expected = [reference_parse_product_details(name) for name in names]
+        reference_time = time.perf_counter() - started
+
+        parse_product_details.cache_clear()
+        started = time.perf_counter()
+        actual = [parse_product_details(name) for name in names]
+        cold_time = time.perf_counter() - started
+        cold_info = parse_product_details.cache_info()
+
+        started = time.perf_counter()
+        [parse_product_details(name) for name in names]
+        warm_time = time.perf_counter() - started
+        warm_info = parse_product_details.cache_info()
+
+        mismatches = [
+            (name, old, new) for name, old, new in zip(names, expected, actual) if old != new
+        ]
+        if mismatches:
+            for name, old, new in mismatches[:10]:
+                self.stderr.write(f"{name!r}: {old!r} != {new!r}")
+            raise CommandError(f"{len(mismatches)} results differ from the previous implementation")
+
+        self.stdout.write(f"previous:      {reference_time:.3f}s")
+        self.stdout.write(
+            f"precompiled:   {cold_time:.3f}s (x{reference_time / cold_time:.1f}, cold cache, "
+            f"hit ratio {hit_ratio(cold_info):.1%})"
+        )
+        self.stdout.write(
+            f"warm cache:    {warm_time:.3f}s (x{reference_time / warm_time:.1f}, "
+            f"hit ratio {hit_ratio(warm_info, cold_info):.1%})"
+        )
+        self.stdout.write(str(warm_info))
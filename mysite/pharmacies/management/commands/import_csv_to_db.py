@@ -1,63 +1,135 @@
 # myapp/management/commands/import_csv_to_db.py
 
-from django.core.management.base import BaseCommand
-from pharmacies.models import Pharmacy, Product
-import csv
-from datetime import datetime
-
-def import_csv_to_db(csv_file_path, pharmacy_number):
-    pharmacy, created = Pharmacy.objects.get_or_create(pharmacy_number=pharmacy_number)
-
-    with open(csv_file_path, newline='', encoding='cp1251') as csvfile:
-        reader = csv.reader(csvfile, delimiter=';')
-        for row in reader:
-            # Проверка и обработка данных перед созданием объекта product
-            name = row[0] if row[0] else "Нет данных"
-            manufacturer = row[1] if row[1] else "Нет данных"
-            country = row[2] if row[2] else "Нет данных"
-            serial = row[3] if row[3] else "Нет данных"
-            price = float(row[4]) if row[4] else 0.0
-            quantity = float(row[5]) if row[5] else 0.0
-            total_price = float(row[6]) if row[6] else 0.0
-            expiry_date = datetime.strptime(row[7], '%d.%m.%Y').date() if row[7] else datetime.strptime('01.01.2100', '%d.%m.%Y').date()
-            category = row[8] if row[8] else "Нет данных"
-            import_date = datetime.strptime(row[9], '%d.%m.%Y').date() if row[9] else datetime.now().date()
-            internal_code = row[10] if row[10] else "Нет данных"
-            wholesale_price = float(row[11]) if row[11] else 0.0
-            retail_price = float(row[12]) if row[12] else 0.0
-            distributor = row[13] if row[13] else "Нет данных"
-            internal_id = row[14] if row[14] else "Нет данных"
-
-            Product.objects.create(
-                name=name,
-                manufacturer=manufacturer,
-                country=country,
-                serial=serial,
-                price=price,
-                quantity=quantity,
-                total_price=total_price,
-                expiry_date=expiry_date,
-                category=category,
-                import_date=import_date,
-                internal_code=internal_code,
-                wholesale_price=wholesale_price,
-                retail_price=retail_price,
-                distributor=distributor,
-                internal_id=internal_id,
-                pharmacy=pharmacy
-            )
+import glob
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pharmacies.inventory import resolve_pharmacy, replace_products
+from pharmacies.loaders import LOADERS
+from pharmacies.signals import suppress_index_signals
+from pharmacies.uploads import detect_file_encoding, iter_csv_file_rows
+
+
+class _TimedRows:
+    """Считает строки и время, потраченное на их разбор"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.count = 0
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            values = next(self._rows)
+        finally:
+            self.seconds += time.perf_counter() - started
+        self.count += 1
+        return values
+
+
+def collect_csv_files(sources):
+    """Файлы, каталоги и glob-шаблоны -> отсортированный список CSV"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(glob.glob(os.path.join(source, '*.csv')))
+        elif os.path.isfile(source):
+            paths.append(source)
+        else:
+            paths.extend(glob.glob(source))
+    return sorted(set(paths))
+
+
+def pharmacy_number_from_path(path):
+    # A1.csv -> 1, novamedika_12.csv -> 12
+    digits = re.findall(r'\d+', os.path.splitext(os.path.basename(path))[0])
+    if not digits:
+        raise CommandError(f"Cannot infer pharmacy number from {path}, pass --pharmacy-number")
+    return digits[-1]
+
 
 class Command(BaseCommand):
-    help = 'Import products from CSV file with pharmacies information'
+    help = (
+        'Offline bulk import of pharmacy CSV exports through the production ingest pipeline. '
+        'Accepts files, directories and glob patterns; each file replaces the stock of its pharmacy.'
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument('csv_file_path', type=str)
-        parser.add_argument('pharmacy_number', type=str)
+        parser.add_argument('sources', nargs='+', help='CSV files, directories or glob patterns')
+        parser.add_argument('--pharmacy-name', default='novamedika')
+        parser.add_argument(
+            '--pharmacy-number',
+            help='Pharmacy number for every file; by default taken from the digits in the file name'
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parse processes per file')
+        parser.add_argument('--loader', choices=LOADERS, default='copy')
+        parser.add_argument('--encoding', help='Skip encoding detection')
+        parser.add_argument('--dry-run', action='store_true', help='Parse and count rows without writing')
+        parser.add_argument('--no-index', action='store_true', help='Skip the Elasticsearch build at the end')
 
     def handle(self, *args, **options):
-        csv_file_path = options['csv_file_path']
-        pharmacy_number = options['pharmacy_number']
-        import_csv_to_db(csv_file_path, pharmacy_number)
-        self.stdout.write(self.style.SUCCESS('Successfully imported products with pharmacies information'))
+        paths = collect_csv_files(options['sources'])
+        if not paths:
+            raise CommandError('No CSV files found')
+
+        dry_run = options['dry_run']
+        totals = {'rows': 0, 'parse': 0.0, 'write': 0.0, 'index': 0.0}
+        started = time.perf_counter()
+
+        # Сигналы не ставят задачу индексации на каждую строку — индекс строится один раз в конце
+        with suppress_index_signals():
+            for path in paths:
+                pharmacy_number = options['pharmacy_number'] or pharmacy_number_from_path(path)
+                encoding = options['encoding'] or detect_file_encoding(path)
+                rows = _TimedRows(iter_csv_file_rows(path, encoding=encoding, workers=options['workers']))
+
+                file_started = time.perf_counter()
+                if dry_run:
+                    for _ in rows:
+                        pass
+                else:
+                    with transaction.atomic():
+                        pharmacy = resolve_pharmacy(options['pharmacy_name'], pharmacy_number)
+                        # Индекс строится один раз в конце, задачи по изменениям не ставим
+                        replace_products(pharmacy, rows, loader=options['loader'])
+                elapsed = time.perf_counter() - file_started
+
+                totals['rows'] += rows.count
+                totals['parse'] += rows.seconds
+                totals['write'] += elapsed - rows.seconds
+                self.stdout.write(
+                    f"{path}: pharmacy #{pharmacy_number}, {rows.count} rows ({encoding}) "
+                    f"in {elapsed:.2f}s, parse {rows.seconds:.2f}s"
+                )
+
+        if not dry_run and not options['no_index']:
+            from pharmacies.elastic import get_client
+            from pharmacies.reindex import rebuild_inline
+
+            # Индекс строится здесь же: офлайн-импорт не зависит от запущенных воркеров
+            index_started = time.perf_counter()
+            try:
+                self.stdout.write(rebuild_inline(get_client()))
+            except RuntimeError as e:
+                raise CommandError(f"{e}. Resume with rebuild_index --inline --resume INDEX")
+            totals['index'] = time.perf_counter() - index_started
+
+        total = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Parsed' if dry_run else 'Imported'} {totals['rows']} rows from {len(paths)} files "
+            f"in {total:.2f}s ({totals['rows'] / total:,.0f} rows/s)"
+        ))
+        self.stdout.write(
+            f"phases: parse {totals['parse']:.2f}s, write {totals['write']:.2f}s, index {totals['index']:.2f}s"
+        )
 
-# python manage.py import_csv_to_db pharmacies/pharma_stores/A1.csv 1
+# python manage.py import_csv_to_db pharmacies/pharma_stores/ --workers 8
+# python manage.py import_csv_to_db pharmacies/pharma_stores/A1.csv --pharmacy-number 1 --dry-run
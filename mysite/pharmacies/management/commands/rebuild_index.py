@@ -1,22 +1,57 @@
-from django.core.management.base import BaseCommand
-from pharmacies.models import Product
-from pharmacies.documents import ProductDocument
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacies.search_index import INDEX_ALIAS, alias_targets, index_versions, rollback_alias
 
-from django.core.management.base import BaseCommand
-from elasticsearch.helpers import bulk
-from pharmacies.documents import ProductDocument
-from pharmacies.models import Product
 
 class Command(BaseCommand):
-    help = "Rebuild Elasticsearch index by batching data"
+    help = (
+        "Rebuild the Elasticsearch index into a new version and swap the products alias (blue/green). "
+        "Partitions are indexed by Celery workers; use --inline to index them in this process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inline', action='store_true', help='Index all partitions here instead of Celery')
+        parser.add_argument('--resume', metavar='INDEX', help='Re-run unfinished partitions of a build')
+        parser.add_argument('--status', metavar='INDEX', help='Show per-partition progress of a build')
+        parser.add_argument('--rollback', action='store_true', help='Point the alias back to the previous version')
+        parser.add_argument('--list', action='store_true', help='Show index versions and the current alias target')
+
+    def handle(self, *args, **options):
+        from pharmacies.elastic import get_client
+        from pharmacies.reindex import partition_progress, rebuild_inline
+        from pharmacies.tasks import full_elasticsearch_resync, resume_reindex
+
+        es_client = get_client()
 
-    def handle(self, *args, **kwargs):
-        chunk_size = 1000  # Размер батча для обработки
-        products = Product.objects.all()
+        if options['list']:
+            current = alias_targets(es_client)
+            for name in index_versions(es_client):
+                marker = f' <- {INDEX_ALIAS}' if name in current else ''
+                self.stdout.write(f"{name}{marker}")
+            return
 
-        for i in range(0, len(products), chunk_size):
-            chunk = products[i:i + chunk_size]
-            ProductDocument().update(chunk)
+        if options['status']:
+            self.stdout.write(str(partition_progress(options['status'])))
+            return
 
-        self.stdout.write(self.style.SUCCESS('Successfully rebuilt index'))
+        if options['rollback']:
+            try:
+                name = rollback_alias(es_client)
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Alias {INDEX_ALIAS} now points to {name}"))
+            return
 
+        if options['inline']:
+            try:
+                result = rebuild_inline(
+                    es_client, options['resume'],
+                    progress=lambda partition, indexed: self.stdout.write(f"{partition.pharmacy}: {indexed} products")
+                )
+            except RuntimeError as e:
+                raise CommandError(f"{e}. Resume with --inline --resume INDEX")
+            self.stdout.write(self.style.SUCCESS(result))
+        elif options['resume']:
+            self.stdout.write(self.style.SUCCESS(resume_reindex.delay(options['resume']).id))
+        else:
+            self.stdout.write(self.style.SUCCESS(full_elasticsearch_resync()))
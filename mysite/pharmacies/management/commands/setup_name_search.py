@@ -0,0 +1,98 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from pharmacies.models import Product
+
+TABLE = Product._meta.db_table
+
+# Триггер держит search_vector в актуальном состоянии при INSERT (в том числе COPY)
+# и при UPDATE имени. search_vector в списке — полный save() ORM пишет туда NULL;
+# уже посчитанное значение при неизменном имени не пересчитывается.
+TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION {TABLE}_search_vector() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.name IS NOT DISTINCT FROM OLD.name
+            AND NEW.search_vector IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+    NEW.search_vector := to_tsvector('russian', coalesce(NEW.name, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {TABLE}_search_vector ON {TABLE};
+CREATE TRIGGER {TABLE}_search_vector
+    BEFORE INSERT OR UPDATE OF name, search_vector ON {TABLE}
+    FOR EACH ROW EXECUTE FUNCTION {TABLE}_search_vector();
+"""
+
+# name__icontains в Django — UPPER(name::text) LIKE UPPER(%s): индекс по тому же выражению
+INDEX_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TABLE}_search_vector_gin "
+    f"ON {TABLE} USING gin (search_vector)",
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TABLE}_name_trgm "
+    f"ON {TABLE} USING gin (UPPER(name::text) gin_trgm_ops)",
+]
+
+# Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс, который IF NOT EXISTS пропустит
+INVALID_INDEXES_SQL = f"""
+SELECT indexrelid::regclass::text FROM pg_index
+WHERE NOT indisvalid AND indexrelid::regclass::text IN ('{TABLE}_search_vector_gin', '{TABLE}_name_trgm')
+"""
+
+BACKFILL_SQL = f"""
+UPDATE {TABLE} SET search_vector = to_tsvector('russian', coalesce(name, ''))
+WHERE uuid IN (
+    SELECT uuid FROM {TABLE}
+    WHERE search_vector IS NULL AND uuid > %s
+    ORDER BY uuid
+    LIMIT %s
+)
+RETURNING uuid
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Install Postgres name search for products: a trigger that keeps search_vector current, "
+        "a batched backfill of existing rows, and GIN (tsvector) and pg_trgm indexes built CONCURRENTLY. "
+        "Idempotent; run after migrate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        # Команда работает в autocommit: каждая пачка — своя короткая транзакция,
+        # а CREATE INDEX CONCURRENTLY внутри транзакции невозможен
+        with connection.cursor() as cursor:
+            cursor.execute(TRIGGER_SQL)
+        self.stdout.write("Trigger installed")
+
+        # Сначала заполняем, потом строим индексы: иначе каждая пачка обновляла бы GIN
+        updated = 0
+        last_uuid = '00000000-0000-0000-0000-000000000000'
+        started = time.perf_counter()
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(BACKFILL_SQL, [last_uuid, options['batch_size']])
+                batch = [row[0] for row in cursor.fetchall()]
+            if not batch:
+                break
+            updated += len(batch)
+            last_uuid = max(batch)
+            self.stdout.write(f"Backfilled {updated} rows ({updated / (time.perf_counter() - started):,.0f} rows/s)")
+            time.sleep(options['pause'])
+
+        with connection.cursor() as cursor:
+            cursor.execute(INVALID_INDEXES_SQL)
+            for (name,) in cursor.fetchall():
+                self.stdout.write(f"Dropping invalid index {name}")
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            for statement in INDEX_SQL:
+                cursor.execute(statement)
+        self.stdout.write(self.style.SUCCESS(f"Name search ready: {updated} rows backfilled, indexes built"))
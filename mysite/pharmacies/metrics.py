@@ -0,0 +1,102 @@
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Фазы загрузки CSV в порядке выполнения
+PHASES = ('decode', 'parse', 'db_write', 'index_fanout')
+
+
+class IngestMetrics:
+    """Счётчики и время по фазам одной загрузки, сохраняются в CsvProcessingTask.result"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counters = Counter()
+        self.phases = defaultdict(float)
+        self.extra = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - started
+
+    def timed_rows(self, rows, phase='parse'):
+        """Оборачивает генератор строк: время внутри next() идёт в фазу разбора"""
+        iterator = iter(rows)
+        while True:
+            started = time.perf_counter()
+            try:
+                values = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.phases[phase] += time.perf_counter() - started
+            yield values
+
+    def as_dict(self):
+        wall = time.perf_counter() - self.started
+        inserted = self.counters['rows_inserted'] + self.counters['rows_updated']
+        write_time = self.phases['parse'] + self.phases['db_write']
+        return {
+            'rows_read': self.counters['rows_read'],
+            'rows_inserted': self.counters['rows_inserted'],
+            'rows_updated': self.counters['rows_updated'],
+            'rows_deleted': self.counters['rows_deleted'],
+            'rows_skipped': self.counters['rows_skipped'],
+            'rows_failed': self.counters['rows_failed'],
+            'bytes_processed': self.counters['bytes_processed'],
+            'phases': {name: round(self.phases[name], 3) for name in PHASES},
+            'wall_time': round(wall, 3),
+            'rows_per_sec': round(self.counters['rows_read'] / write_time, 1) if write_time else None,
+            'written_per_sec': round(inserted / write_time, 1) if write_time else None,
+            **self.extra,
+        }
+
+    def save(self, task_id, **fields):
+        from .models import CsvProcessingTask
+
+        CsvProcessingTask.objects.filter(task_id=task_id).update(result=self.as_dict(), **fields)
+
+
+def summarize_tasks(tasks):
+    """
+    Сводка по загрузкам: по аптекам (медленные аптеки) и по дням (регрессии после деплоя).
+    tasks — словари с полями CsvProcessingTask.
+    """
+    by_pharmacy = defaultdict(list)
+    by_day = defaultdict(list)
+    for task in tasks:
+        by_pharmacy[(task['pharmacy_name'], task['pharmacy_number'])].append(task)
+        by_day[task['created_at'].date().isoformat()].append(task)
+
+    def summary(group):
+        results = [task['result'] for task in group if isinstance(task['result'], dict)]
+        speeds = sorted(r['rows_per_sec'] for r in results if r.get('rows_per_sec'))
+        walls = [r['wall_time'] for r in results if r.get('wall_time') is not None]
+        phases = {
+            name: round(sum(r['phases'].get(name, 0) for r in results if 'phases' in r) / len(results), 3)
+            for name in PHASES
+        } if results else {}
+        return {
+            'runs': len(group),
+            'completed': sum(1 for task in group if task['status'] == 'completed'),
+            'failed': sum(1 for task in group if task['status'] == 'failed'),
+            'rows_read': sum(r.get('rows_read', 0) for r in results),
+            'median_rows_per_sec': speeds[len(speeds) // 2] if speeds else None,
+            'min_rows_per_sec': speeds[0] if speeds else None,
+            'avg_wall_time': round(sum(walls) / len(walls), 3) if walls else None,
+            'max_wall_time': max(walls) if walls else None,
+            'avg_phases': phases,
+        }
+
+    pharmacies = [
+        {'pharmacy_name': name, 'pharmacy_number': number, **summary(group)}
+        for (name, number), group in by_pharmacy.items()
+    ]
+    # Самые медленные аптеки — первыми
+    pharmacies.sort(key=lambda item: item['median_rows_per_sec'] or 0)
+    days = [{'date': day, **summary(group)} for day, group in sorted(by_day.items())]
+    return {'pharmacies': pharmacies, 'days': days}
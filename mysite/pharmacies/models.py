@@ -1,4 +1,6 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import F
 from django.urls import reverse
 import uuid
 
@@ -22,12 +24,29 @@ class Pharmacy(models.Model):
     address = models.CharField(max_length=255, blank=True, null=True)  # Эти поля можно заполнить позже
     phone = models.CharField(max_length=100, blank=True, null=True)  # Эти поля можно заполнить позже
     opening_hours = models.CharField(max_length=255, blank=True, null=True)
+    active_generation = models.PositiveIntegerField(default=0, editable=False)  # Поколение остатков, видимое в поиске
 
 
 
+    # Поля аптеки, продублированные в документах товаров
+    INDEXED_FIELDS = ('name', 'pharmacy_number', 'city')
+
     def __str__(self):
         return f"{self.name} №{self.pharmacy_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._indexed_snapshot = instance.indexed_values()
+        return instance
+
+    def indexed_values(self):
+        return tuple(self.__dict__.get(name) for name in self.INDEXED_FIELDS)
+
+    def indexed_fields_changed(self):
+        """Изменились ли поля, которые хранятся в индексе (с момента загрузки из базы)"""
+        return getattr(self, '_indexed_snapshot', None) != self.indexed_values()
+
     def get_absolute_url(self):
         return reverse('pharmacies:pharmacy_detail', args=[self.name, self.pharmacy_number])
 
@@ -41,6 +60,12 @@ class Pharmacy(models.Model):
 
 
 
+class ProductQuerySet(models.QuerySet):
+    def live(self):
+        """Только товары активного поколения аптеки (без теневой загрузки)"""
+        return self.filter(generation=F('pharmacy__active_generation'))
+
+
 class Product(models.Model):
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
@@ -61,6 +86,13 @@ class Product(models.Model):
     internal_id = models.CharField(max_length=255)
     pharmacy = models.ForeignKey('Pharmacy', on_delete=models.CASCADE, related_name='products', db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
+    fingerprint = models.CharField(max_length=40, blank=True, default='', editable=False)  # Отпечаток содержимого строки
+    generation = models.PositiveIntegerField(default=0, editable=False)  # Поколение загрузки остатков
+    # to_tsvector('russian', name): заполняет триггер, индексы GIN и pg_trgm —
+    # команда setup_name_search (CREATE INDEX CONCURRENTLY, без блокировки таблицы)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         serials = self.serial.split(',')
@@ -68,12 +100,23 @@ class Product(models.Model):
         additional_serials = ' и другие' if len(serials) > 1 else ''
         return f"{self.name} - Серийный номер: {first_serial}{additional_serials}"
 
+    def save(self, *args, **kwargs):
+        from .inventory import product_fingerprint
+        self.fingerprint = product_fingerprint(self)
+        if self._state.adding and not self.generation and self.pharmacy_id:
+            # Товар, добавленный вручную, сразу попадает в активное поколение
+            self.generation = self.pharmacy.active_generation
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'fingerprint'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
         constraints = [
             models.UniqueConstraint(
-                fields=['name', 'form', 'price', 'quantity', 'serial', 'pharmacy', 'expiry_date'],
+                fields=['name', 'form', 'price', 'quantity', 'serial', 'pharmacy', 'expiry_date', 'generation'],
                 name='unique_product'
             )
         ]
@@ -81,6 +124,7 @@ class Product(models.Model):
             models.Index(fields=['name', 'serial']),
             models.Index(fields=['expiry_date']),
             models.Index(fields=['category']),
+            models.Index(fields=['pharmacy', 'generation']),
         ]
 
 
@@ -120,9 +164,51 @@ class CsvProcessingTask(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     result = models.JSONField(null=True, blank=True)
+    checksum = models.CharField(max_length=64, blank=True, default='')  # sha256 загруженного файла
 
     class Meta:
         db_table = 'pharmacies_csvprocessingtask'
         indexes = [
             models.Index(fields=['task_id']),
+            models.Index(fields=['pharmacy_name', 'pharmacy_number', '-created_at']),
+        ]
+
+
+class IndexChange(models.Model):
+    """Outbox синхронизации с Elasticsearch: пишется в той же транзакции, что и изменение"""
+    entity = models.CharField(max_length=10, choices=[
+        ('product', 'Product'),
+        ('pharmacy', 'Pharmacy')
+    ], default='product')
+    object_id = models.UUIDField()
+    op = models.CharField(max_length=6, choices=[
+        ('upsert', 'Upsert'),
+        ('delete', 'Delete')
+    ])
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'pharmacies_indexchange'
+
+
+class ReindexPartition(models.Model):
+    """Часть полной переиндексации (одна аптека) с чекпоинтом для продолжения"""
+    index_name = models.CharField(max_length=100, db_index=True)
+    pharmacy = models.ForeignKey('Pharmacy', on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed')
+    ], default='pending')
+    indexed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    last_uuid = models.UUIDField(null=True, blank=True)  # Последний отправленный товар (ключ продолжения)
+    error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'pharmacies_reindexpartition'
+        constraints = [
+            models.UniqueConstraint(fields=['index_name', 'pharmacy'], name='unique_reindex_partition')
         ]
@@ -0,0 +1,166 @@
+import logging
+import re
+from collections import Counter
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDNAMES = [
+    'name', 'manufacturer', 'country', 'serial', 'price', 'quantity',
+    'total_price', 'expiry_date', 'category', 'import_date',
+    'internal_code', 'wholesale_price', 'retail_price',
+    'distributor', 'internal_id', 'pharmacy_number'
+]
+
+FORM_KEYWORDS = (
+    'АМП', 'ТАБЛ', 'ТАБЛ.', 'ТАБЛ,', 'ТАБЛ', 'ТАБЛ.П/О', 'ТАБЛ.РАСТВ.', 'МАЗЬ',
+    'СУПП', 'ГЕЛЬ', 'КАПЛИ', 'ФЛ', 'Р-Р', 'ТУБА', 'капс',  'уп', 'паста',
+    'пак', 'пак.,', 'пак.', 'пор', 'пор.', 'жев.табл', 'жев.табл.', 'фильтр-пакет',
+    'фильтр-пакет,', 'табл.шип', 'ТАБЛ.РАССАС', 'конт', 'крем', 'табл.жев',
+    'драже', 'ф-кап', 'линим', 'капс.рект', 'фл.,', 'супп.ваг', 'саше', 'пастилки',
+)
+
+# Регулярное выражение для поиска формы (ключевое слово + остаток строки),
+# компилируется один раз при импорте
+FORM_REGEX = re.compile(
+    r'(' + '|'.join(re.escape(kw) for kw in FORM_KEYWORDS) + r')([\s\.,].*)?$',
+    re.IGNORECASE
+)
+FORM_PREFIX_REGEX = re.compile(r'^[\s\.,]+')
+
+# Названия повторяются во всех аптеках и во всех выгрузках
+PRODUCT_DETAILS_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=PRODUCT_DETAILS_CACHE_SIZE)
+def parse_product_details(product_string):
+    """Делит строку товара на (название, форма выпуска)"""
+    if not product_string:
+        return "-", "-"
+
+    match = FORM_REGEX.search(product_string)
+    if match:
+        form_start = match.start()
+        name_part = product_string[:form_start].strip()  # Часть до формы
+        form_part = product_string[form_start:].strip()  # Форма и всё после неё
+
+        # Удаляем лишние пробелы/знаки препинания в начале формы
+        form_part = FORM_PREFIX_REGEX.sub('', form_part)
+
+        # Если name_part пусто (например, строка начинается с формы), возвращаем "-" для названия
+        return (name_part if name_part else "-", form_part)
+
+    # Если форма не найдена, возвращаем исходную строку как название, а форму как "-"
+    return (product_string, "-")
+
+
+SERIAL_REGEX = re.compile(r'[\s\-_]+')
+# Только ASCII-цифры и четырёхзначный год: '05.03.27' — ошибка, а не 27 год
+DATE_REGEX = re.compile(r'^(\d{1,2})\.(\d{1,2})\.(\d{4})$', re.ASCII)
+ZERO = Decimal('0')
+
+
+# Даты годности и поступления сильно повторяются внутри одной выгрузки
+DATE_CACHE_SIZE = 8192
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date_string):
+    """dd.mm.yyyy -> date без strptime/strftime"""
+    match = DATE_REGEX.fullmatch(date_string)
+    if not match:
+        raise ValueError(f"Invalid date format: {date_string}")
+    day, month, year = match.groups()
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        raise ValueError(f"Invalid date format: {date_string}")
+
+
+def convert_date_format(date_string):
+    return parse_date(date_string).isoformat()
+
+
+def parse_decimal(value, default=None):
+    """'12,50' -> Decimal('12.50') без промежуточного float"""
+    if not value:
+        return default
+    try:
+        result = Decimal(value.replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"Invalid number: {value}")
+    if not result.is_finite():
+        raise ValueError(f"Invalid number: {value}")
+    return result
+
+
+def normalize_row(row):
+    """Приводит строку CSV к полям Product; None для пустой строки"""
+    from .inventory import product_fingerprint
+
+    if not any(row.values()):
+        logger.warning(f"Row: {row}", exc_info=True)
+        return None
+    product_name = row['name']
+    product_form = '-'
+    if row['category'] == 'Лексредства':
+        product_name, product_form = parse_product_details(row['name'])
+    values = {
+        'name': product_name,
+        'form': product_form,
+        'manufacturer': (row['manufacturer'] or '').strip(),
+        'country': (row['country'] or '').strip(),
+        'serial': SERIAL_REGEX.sub('', row['serial']).upper(),
+        'price': parse_decimal(row['price'], ZERO),
+        'quantity': parse_decimal(row['quantity'], ZERO),
+        'total_price': parse_decimal(row['total_price'], ZERO),
+        'expiry_date': parse_date(row['expiry_date']),
+        'category': row['category'],
+        'import_date': parse_date(row['import_date']),
+        'internal_code': row['internal_code'],
+        'wholesale_price': parse_decimal(row['wholesale_price']),
+        'retail_price': parse_decimal(row['retail_price']),
+        'distributor': (row['distributor'] or '').strip(),
+        'internal_id': row['internal_id'],
+    }
+    values['fingerprint'] = product_fingerprint(values)
+    return values
+
+
+def normalize_rows(reader, stats=None):
+    """
+    Нормализует строки, пропуская и логируя ошибочные.
+    stats (Counter) получает rows_read, rows_skipped и rows_failed.
+    """
+    stats = stats if stats is not None else Counter()
+    for row in reader:
+        stats['rows_read'] += 1
+        try:
+            values = normalize_row(row)
+        except Exception as e:
+            stats['rows_failed'] += 1
+            logger.error(f"Error processing row: {e}")
+            continue
+        if values is None:
+            stats['rows_skipped'] += 1
+            continue
+        yield values
+
+
+def dedupe_rows(rows, stats=None):
+    """Пропускает дубликаты в CSV по (name, serial, expiry_date), оставляя первую строку"""
+    stats = stats if stats is not None else Counter()
+    processed_products = set()
+    for values in rows:
+        product_key = (values['name'], values['serial'], values['expiry_date'])
+        if product_key in processed_products:
+            stats['rows_skipped'] += 1
+            continue
+        processed_products.add(product_key)
+        yield values
+
+
+def iter_normalized_rows(reader, stats=None):
+    return dedupe_rows(normalize_rows(reader, stats), stats)
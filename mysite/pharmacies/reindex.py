@@ -0,0 +1,167 @@
+import logging
+from itertools import islice
+
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from elasticsearch import helpers
+
+from .bulk_serializer import (
+    PRODUCT_COLUMNS, PharmacyDocuments, delete_lines, ndjson_chunks, send_body, send_chunks
+)
+from .models import Pharmacy, Product, ReindexPartition
+from .search_index import BUILDING_INDEX_KEY, BUILDING_INDEX_TTL, start_build
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+THREAD_COUNT = 4
+
+
+def _partition_rows(partition):
+    """Товары аптеки по возрастанию UUID, начиная после чекпоинта (серверный курсор)"""
+    products = Product.objects.live().filter(pharmacy_id=partition.pharmacy_id)
+    if partition.last_uuid:
+        products = products.filter(uuid__gt=partition.last_uuid)
+    return (
+        products.order_by('uuid')
+        .values_list(*PRODUCT_COLUMNS)
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def plan_partitions(index_name):
+    """По одной части на аптеку; возвращает id частей"""
+    ReindexPartition.objects.bulk_create(
+        [
+            ReindexPartition(index_name=index_name, pharmacy_id=pharmacy_id)
+            for pharmacy_id in Pharmacy.objects.values_list('uuid', flat=True)
+        ],
+        ignore_conflicts=True
+    )
+    return list(
+        ReindexPartition.objects.filter(index_name=index_name).values_list('id', flat=True)
+    )
+
+
+def run_partition(es, partition):
+    """
+    Заливает одну аптеку в индекс partition.index_name. Каждые CHUNK_SIZE
+    документов сохраняет прогресс и последний UUID: повторный запуск
+    продолжит с него, а не с начала.
+    """
+    pharmacies = PharmacyDocuments([partition.pharmacy])
+    index_name = partition.index_name
+
+    partition.status = 'processing'
+    partition.error = ''
+    partition.save(update_fields=['status', 'error', 'updated_at'])
+
+    chunks = ndjson_chunks(_partition_rows(partition), [index_name], pharmacies, chunk_size=CHUNK_SIZE)
+    try:
+        # Результаты приходят в порядке чанков, чекпоинт не перескакивает через неотправленное
+        for success, errors, last_uuid in send_chunks(es, chunks, thread_count=THREAD_COUNT):
+            partition.indexed += success
+            partition.failed += len(errors)
+            for error in errors[:10]:
+                logger.error(f"ES indexing failed: {error}")
+            partition.last_uuid = last_uuid
+            partition.save(update_fields=['indexed', 'failed', 'last_uuid', 'updated_at'])
+    except Exception as e:
+        partition.status = 'failed'
+        partition.error = str(e)
+        partition.save(update_fields=['status', 'error', 'updated_at'])
+        raise
+
+    partition.status = 'completed'
+    partition.save(update_fields=['status', 'updated_at'])
+    return partition.indexed
+
+
+def catch_up(es, index_name, since):
+    """
+    Досылает строки, изменённые после начала заливки, и удаляет документы
+    товаров, которых больше нет среди активных. Удаления во время сборки
+    доходят до нового индекса через BUILDING_INDEX_KEY в кэше, а его может
+    потерять Redis, поэтому их сверяем с базой.
+    Возвращает (досланных, удалённых).
+    """
+    rows = (
+        Product.objects.live().filter(updated_at__gte=since)
+        .values_list(*PRODUCT_COLUMNS)
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    indexed = 0
+    for success, errors, _ in send_chunks(
+        es, ndjson_chunks(rows, [index_name], PharmacyDocuments(), chunk_size=CHUNK_SIZE), thread_count=1
+    ):
+        indexed += success
+
+    deleted = 0
+    for chunk in _chunks(_stale_document_ids(es, index_name), CHUNK_SIZE):
+        success, errors = send_body(es, delete_lines(chunk, [index_name]))
+        deleted += success
+        for error in errors[:10]:
+            logger.error(f"ES delete failed: {error}")
+    return indexed, deleted
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _stale_document_ids(es, index_name):
+    """id документов индекса, которых нет среди Product.objects.live()"""
+    # refresh_interval строящегося индекса выключен: без refresh scroll не увидит заливку
+    es.indices.refresh(index=index_name)
+    hits = helpers.scan(
+        es, index=index_name, query={"query": {"match_all": {}}, "_source": False}, size=CHUNK_SIZE
+    )
+    for chunk in _chunks((hit['_id'] for hit in hits), CHUNK_SIZE):
+        live = {
+            str(product_uuid)
+            for product_uuid in Product.objects.live().filter(uuid__in=chunk).values_list('uuid', flat=True)
+        }
+        yield from (document_id for document_id in chunk if document_id not in live)
+
+
+def partition_progress(index_name):
+    """Сводка по частям переиндексации"""
+    partitions = ReindexPartition.objects.filter(index_name=index_name)
+    totals = partitions.aggregate(
+        partitions=Count('id'),
+        completed=Count('id', filter=Q(status='completed')),
+        failed_partitions=Count('id', filter=Q(status='failed')),
+        indexed=Sum('indexed'),
+        failed=Sum('failed'),
+    )
+    totals['failed_pharmacies'] = list(
+        partitions.filter(status='failed').values('pharmacy__name', 'pharmacy__pharmacy_number', 'error')
+    )
+    return totals
+
+
+def rebuild_inline(es, index_name=None, progress=None):
+    """
+    Переиндексация blue/green в текущем процессе, без воркеров Celery
+    (офлайн-импорт, rebuild_index --inline). index_name — продолжить начатую
+    сборку; progress(partition, indexed) вызывается после каждой аптеки.
+    Возвращает итог complete_reindex.
+    """
+    from .tasks import complete_reindex
+
+    if index_name:
+        cache.set(BUILDING_INDEX_KEY, index_name, BUILDING_INDEX_TTL)
+    else:
+        index_name = start_build(es)
+    plan_partitions(index_name)
+    partitions = ReindexPartition.objects.filter(index_name=index_name).exclude(status='completed')
+    for partition in partitions.select_related('pharmacy'):
+        try:
+            indexed = run_partition(es, partition)
+        except Exception as e:
+            raise RuntimeError(f"{partition.pharmacy} failed in {index_name}: {e}") from e
+        if progress:
+            progress(partition, indexed)
+    return complete_reindex(index_name)
@@ -0,0 +1,109 @@
+"""
+Кэш результатов поисковых страниц в Redis. Ключ — нормализованный запрос,
+город, форма и страница; в ключ входит поколение города, которое
+увеличивается после загрузки остатков аптеки этого города. Новая загрузка
+делает недостижимыми только записи своего города (и «всех городов»),
+старые записи истекают по SEARCH_CACHE_TTL.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+VIEWS = ('index', 'search', 'search_products', 'search_pharmacies')
+
+ALL_CITIES = '*'
+GENERATION_KEY = 'search_generation:{}'
+ENTRY_KEY = 'search_result:{view}:{generation}:{digest}'
+COUNTER_KEY = 'search_cache_{outcome}:{view}'
+
+def normalize(text):
+    """
+    Регистр не даёт отдельных записей: все страницы ищут без учёта регистра.
+    ё и пробелы внутри не трогаем — для icontains это разные запросы.
+    """
+    return (text or '').strip().lower()
+
+
+def city_key(city):
+    city = normalize(city)
+    return city if city and city != 'все города' else ALL_CITIES
+
+
+def generation(city):
+    """
+    Текущее поколение города. Начальное значение — время в наносекундах:
+    счётчик, потерянный при вытеснении из Redis, не совпадёт с прежним.
+    """
+    key = GENERATION_KEY.format(city)
+    value = cache.get(key)
+    if value is None:
+        value = time.time_ns()
+        if not cache.add(key, value, timeout=None):
+            value = cache.get(key, value)
+    return value
+
+
+def bump_generation(city):
+    """Сбрасывает записи города и записи без фильтра по городу"""
+    for key in {GENERATION_KEY.format(city_key(city)), GENERATION_KEY.format(ALL_CITIES)}:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_city(city):
+    """
+    После загрузки остатков: сразу (Postgres уже видит новые строки) и ещё раз,
+    когда изменения дойдут до индекса, чтобы не осталось закэшированного
+    промежуточного результата ES.
+    """
+    from .tasks import bump_search_generation
+
+    bump_generation(city)
+    bump_search_generation.apply_async(args=[city], countdown=settings.SEARCH_CACHE_INDEX_LAG)
+
+
+def _count(view, outcome):
+    key = COUNTER_KEY.format(outcome=outcome, view=view)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def cached_result(view, compute, query='', city='', form='', page=''):
+    """Результат compute() из кэша или вычисленный и сохранённый"""
+    # Город в ключе как есть: часть страниц фильтрует по нему с учётом регистра
+    payload = json.dumps([normalize(query), (city or '').strip(), normalize(form), page or ''], ensure_ascii=False)
+    key = ENTRY_KEY.format(
+        view=view, generation=generation(city_key(city)),
+        digest=hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    )
+    result = cache.get(key)
+    if result is not None:
+        _count(view, 'hits')
+        return result
+    _count(view, 'misses')
+    result = compute()
+    cache.set(key, result, settings.SEARCH_CACHE_TTL)
+    return result
+
+
+def stats():
+    """Попадания и промахи по страницам с момента последнего сброса счётчиков"""
+    keys = [COUNTER_KEY.format(outcome=outcome, view=view) for view in VIEWS for outcome in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    result = {}
+    for view in VIEWS:
+        hits = values.get(COUNTER_KEY.format(outcome='hits', view=view), 0)
+        misses = values.get(COUNTER_KEY.format(outcome='misses', view=view), 0)
+        result[view] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return result
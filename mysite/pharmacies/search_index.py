@@ -0,0 +1,162 @@
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .documents import ProductDocument
+
+logger = logging.getLogger(__name__)
+
+# Поиск и синхронизация работают через алиас, за ним — версионированные индексы products-<время>
+INDEX_ALIAS = ProductDocument.Index.name
+
+# На время заливки: без реплик и без refresh
+BULK_LOAD_SETTINGS = {'number_of_replicas': 0, 'refresh_interval': '-1'}
+
+# Индекс, который сейчас строится: синхронизация пишет и в него, чтобы не потерять изменения
+BUILDING_INDEX_KEY = 'products_building_index'
+BUILDING_INDEX_TTL = 6 * 3600
+
+# Сколько предыдущих версий оставлять для отката
+KEEP_VERSIONS = 2
+
+REFRESH_SCHEDULED_KEY = 'products_refresh_scheduled'
+
+
+def new_index_name():
+    return f"{INDEX_ALIAS}-{timezone.now():%Y%m%d%H%M%S}"
+
+
+def live_settings():
+    """Настройки рабочего индекса из ProductDocument.Index"""
+    return {
+        'number_of_replicas': ProductDocument.Index.settings['number_of_replicas'],
+        'refresh_interval': ProductDocument.Index.settings['refresh_interval'],
+    }
+
+
+def create_index(es, name, bulk_load=True):
+    """Создаёт индекс с маппингом ProductDocument; bulk_load — настройки для заливки"""
+    index = ProductDocument._index.clone(name=name)
+    if bulk_load:
+        index.settings(**BULK_LOAD_SETTINGS)
+    index.create(using=es)
+    return name
+
+
+def alias_targets(es):
+    """Индексы, на которые сейчас указывает алиас"""
+    if not es.indices.exists_alias(name=INDEX_ALIAS):
+        return []
+    return sorted(es.indices.get_alias(name=INDEX_ALIAS))
+
+
+def ensure_index(es):
+    """Гарантирует, что алиас существует (первый запуск на пустом кластере)"""
+    if es.indices.exists(index=INDEX_ALIAS):
+        return
+    name = create_index(es, new_index_name(), bulk_load=False)
+    es.indices.update_aliases(body={'actions': [{'add': {'index': name, 'alias': INDEX_ALIAS}}]})
+
+
+def write_targets(es):
+    """Куда писать изменения: алиас и строящийся индекс, если идёт переиндексация"""
+    targets = [INDEX_ALIAS]
+    building = cache.get(BUILDING_INDEX_KEY)
+    if building and building not in alias_targets(es):
+        targets.append(building)
+    return targets
+
+
+def start_build(es):
+    name = create_index(es, new_index_name())
+    cache.set(BUILDING_INDEX_KEY, name, BUILDING_INDEX_TTL)
+    return name
+
+
+def refresh_kwargs(wait_for=False):
+    """
+    Параметры bulk для видимости записи. По умолчанию пусто — документы станут
+    видны по refresh_interval; wait_for=True — запрос дождётся ближайшего refresh
+    (для вызывающих, которым нужно читать сразу после записи).
+    """
+    return {'refresh': 'wait_for'} if wait_for else {}
+
+
+def changes_applied(wait_for=False):
+    """
+    Вызывается после записи в индекс вместо прямого refresh.
+    При INDEX_REFRESH_POLICY=debounced серия записей даёт один отложенный
+    refresh на окно INDEX_REFRESH_DEBOUNCE, при interval — ничего.
+    """
+    if wait_for or settings.INDEX_REFRESH_POLICY != 'debounced':
+        return
+    window = settings.INDEX_REFRESH_DEBOUNCE
+    # None вместо False — ошибка Redis: refresh ставим, чтобы изменения не остались невидимыми
+    if cache.add(REFRESH_SCHEDULED_KEY, 1, timeout=max(window * 10, 60)) is not False:
+        from .tasks import refresh_index
+        refresh_index.apply_async(countdown=window)
+
+
+def index_created_at(es, name):
+    """Время создания индекса (с него начинается догонка изменений)"""
+    settings = es.indices.get_settings(index=name)[name]['settings']['index']
+    return datetime.fromtimestamp(int(settings['creation_date']) / 1000, tz=dt_timezone.utc)
+
+
+def finish_build(es, name):
+    """Возвращает реплики и refresh, сливает сегменты"""
+    es.indices.put_settings(index=name, body={'index': live_settings()})
+    es.indices.refresh(index=name)
+    es.indices.forcemerge(index=name, max_num_segments=1, request_timeout=3600)
+
+
+def swap_alias(es, name):
+    """
+    Атомарно переводит алиас на новый индекс. Старые версии остаются для отката.
+    Если products ещё обычный индекс (до перехода на алиасы), он удаляется
+    в той же операции — алиас не может совпадать с именем индекса.
+    """
+    actions = [{'add': {'index': name, 'alias': INDEX_ALIAS}}]
+    previous = alias_targets(es)
+    if previous:
+        actions += [{'remove': {'index': index, 'alias': INDEX_ALIAS}} for index in previous]
+    elif es.indices.exists(index=INDEX_ALIAS):
+        logger.warning(f"Replacing concrete index '{INDEX_ALIAS}' with an alias, it cannot be rolled back")
+        actions.append({'remove_index': {'index': INDEX_ALIAS}})
+    es.indices.update_aliases(body={'actions': actions})
+    cache.delete(BUILDING_INDEX_KEY)
+    return previous
+
+
+def abort_build(es, name):
+    cache.delete(BUILDING_INDEX_KEY)
+    es.indices.delete(index=name, ignore=[404])
+
+
+def index_versions(es):
+    """Все версии индекса, от старых к новым"""
+    return sorted(es.indices.get(index=f"{INDEX_ALIAS}-*"))
+
+
+def rollback_alias(es):
+    """Переводит алиас на предыдущую версию индекса"""
+    current = alias_targets(es)
+    older = [name for name in index_versions(es) if current and name < current[0]]
+    if not older:
+        raise RuntimeError("No previous index version to roll back to")
+    swap_alias(es, older[-1])
+    return older[-1]
+
+
+def prune_versions(es, keep=KEEP_VERSIONS):
+    """Удаляет старые версии, кроме текущей и keep предыдущих"""
+    current = set(alias_targets(es))
+    building = cache.get(BUILDING_INDEX_KEY)
+    older = [name for name in index_versions(es) if name not in current and name != building]
+    stale = older[:-keep] if keep else older
+    for name in stale:
+        es.indices.delete(index=name, ignore=[404])
+    return stale
@@ -0,0 +1,37 @@
+"""
+Шаблоны поисковых запросов к индексу товаров. Поля и анализаторы — в
+documents.ProductDocument: name.prefix (edge-ngram при индексации),
+name.ru (русская морфология), name.keyword (нормализованный ключ).
+"""
+
+# Нечёткий поиск только для слов не короче этого: на коротких он раздувает запрос
+FUZZY_MIN_LENGTH = 5
+
+
+def name_query(text):
+    """
+    Поиск по названию для строки поиска и подсказок. Совпасть должны все слова
+    как готовые префиксы (term-поиск по name.prefix) или, для длинных запросов,
+    как целые слова с опечаткой. Словоформы и точное название поднимают результат.
+    """
+    text = text.strip()
+    match = [{"match": {"name.prefix": {"query": text, "operator": "and"}}}]
+    if len(text) >= FUZZY_MIN_LENGTH:
+        # Опечатки — только по целым словам, без раскрытия префиксов
+        match.append({"match": {"name": {
+            "query": text, "fuzziness": "AUTO", "prefix_length": 1, "operator": "and"
+        }}})
+    return {
+        "bool": {
+            "must": [{"bool": {"should": match, "minimum_should_match": 1}}],
+            "should": [
+                {"term": {"name.keyword": {"value": text, "boost": 10}}},
+                {"match": {"name.ru": {"query": text, "operator": "and", "boost": 3}}},
+            ],
+        }
+    }
+
+
+def city_filter(city):
+    """Точный фильтр по городу аптеки (pharmacy.city — keyword)"""
+    return {"term": {"pharmacy.city": city}}
@@ -0,0 +1,266 @@
+"""
+Выборки для страниц поиска: группировка считается на стороне ES или
+Postgres, страницы — по ключу последней строки (без COUNT и OFFSET).
+"""
+import base64
+import binascii
+import json
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg, JSONBAgg
+from django.db.models import F, Max, Min, Q, Sum
+from django.db.models.functions import JSONObject
+
+from . import elastic
+from .search_index import INDEX_ALIAS
+from .search_queries import city_filter, name_query
+
+GROUPS_PAGE_SIZE = 50
+GROUPS_CURSOR_KEYS = ('name', 'city')
+
+OFFERS_PAGE_SIZE = 50
+OFFERS_CURSOR_KEYS = ('price', 'name', 'form', 'pharmacy')
+
+PRODUCTS_PAGE_SIZE = 50
+PRODUCTS_CURSOR_KEYS = ('key',)
+
+
+def encode_after(after_key):
+    """Ключ последней строки страницы -> строка для параметра ?after="""
+    if not after_key:
+        return ''
+    raw = json.dumps(after_key, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_after(value, keys=GROUPS_CURSOR_KEYS):
+    """Обратное encode_after; мусор в параметре — первая страница"""
+    if not value:
+        return None
+    try:
+        after_key = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+    if not isinstance(after_key, dict) or set(after_key) != set(keys):
+        return None
+    return after_key
+
+
+def product_groups(query='', city='', after=None, size=GROUPS_PAGE_SIZE):
+    """
+    Группы «название x город» для главной страницы одним запросом к ES:
+    число товаров и минимальная цена в группе. Страницы — через after_key
+    composite-агрегации, поэтому в выдачу попадают все совпадения, а не
+    первые hits. Без COUNT: возвращает (группы, after следующей страницы или '').
+    """
+    filters = []
+    if city:
+        filters.append(city_filter(city))
+    body = {
+        "size": 0,
+        "query": {"bool": {"must": [name_query(query)] if query else [], "filter": filters}},
+        "aggs": {
+            "groups": {
+                "composite": {
+                    "size": size,
+                    "sources": [
+                        {"name": {"terms": {"field": "name.keyword"}}},
+                        {"city": {"terms": {"field": "pharmacy.city"}}},
+                    ],
+                },
+                "aggs": {
+                    "min_price": {"min": {"field": "price"}},
+                    # Название для показа: name.keyword нормализован (нижний регистр)
+                    "cheapest": {"top_hits": {
+                        "size": 1, "sort": [{"price": "asc"}], "_source": ["name"]
+                    }},
+                },
+            },
+        },
+    }
+    if after:
+        body["aggs"]["groups"]["composite"]["after"] = after
+
+    response = elastic.search(index=INDEX_ALIAS, body=body)
+    aggregations = response["aggregations"]
+    groups = []
+    for bucket in aggregations["groups"]["buckets"]:
+        hits = bucket["cheapest"]["hits"]["hits"]
+        groups.append({
+            "name": hits[0]["_source"]["name"] if hits else bucket["key"]["name"],
+            "pharmacy__city": bucket["key"]["city"],
+            "count": bucket["doc_count"],
+            "min_price": bucket["min_price"]["value"],
+        })
+    next_after = ''
+    # Неполная страница — последняя, даже если ES вернул after_key
+    if len(groups) == size:
+        next_after = encode_after(aggregations["groups"].get("after_key"))
+    return groups, next_after
+
+
+def _after_offer(after):
+    """Условие «строго после after» для сортировки (цена, название, форма, аптека)"""
+    if not all(isinstance(value, str) for value in after.values()):
+        return None
+    try:
+        price = Decimal(after['price'])
+        pharmacy = uuid.UUID(after['pharmacy'])
+    except (InvalidOperation, ValueError):
+        return None
+    name, form = after['name'], after['form']
+    return Q(min_price__gt=price) | Q(min_price=price) & (
+        Q(name__gt=name) | Q(name=name) & (
+            Q(form__gt=form) | Q(form=form) & Q(pharmacy_id__gt=pharmacy)
+        )
+    )
+
+
+def product_offers(products, after=None, size=OFFERS_PAGE_SIZE):
+    """
+    Группы «товар x аптека» из отфильтрованного queryset товаров одним
+    GROUP BY: минимальная цена, сумма остатков, последнее обновление и
+    данные аптеки (JSON). Страница — size групп после ключа after.
+    Возвращает (группы, after следующей страницы или '').
+    """
+    groups = (
+        products.order_by()
+        .values(
+            'name', 'form', 'pharmacy_id',
+            pharmacy_name=F('pharmacy__name'),
+            pharmacy_number=F('pharmacy__pharmacy_number'),
+            pharmacy_city=F('pharmacy__city'),
+            pharmacy_address=F('pharmacy__address'),
+            pharmacy_phone=F('pharmacy__phone'),
+        )
+        .annotate(
+            min_price=Min('price'),
+            total_quantity=Sum('quantity'),
+            last_updated_at=Max('updated_at'),
+            # Производитель и страна — как у самой дешёвой строки группы
+            manufacturers=ArrayAgg('manufacturer', ordering='price'),
+            countries=ArrayAgg('country', ordering='price'),
+            pharmacies=JSONBAgg(
+                JSONObject(
+                    pharmacy_name='pharmacy__name',
+                    pharmacy_number='pharmacy__pharmacy_number',
+                    pharmacy_city='pharmacy__city',
+                    pharmacy_address='pharmacy__address',
+                    pharmacy_phone='pharmacy__phone',
+                ),
+                distinct=True,
+            ),
+        )
+        .order_by('min_price', 'name', 'form', 'pharmacy_id')
+    )
+    condition = _after_offer(after) if after else None
+    if condition is not None:
+        groups = groups.filter(condition)
+
+    # Одна лишняя строка показывает, есть ли следующая страница
+    rows = list(groups[:size + 1])
+    offers = [
+        {
+            'name': row['name'],
+            'form': row['form'],
+            'pharmacy_id': row['pharmacy_id'],
+            'pharmacy_name': row['pharmacy_name'],
+            'pharmacy_number': row['pharmacy_number'],
+            'pharmacy_city': row['pharmacy_city'],
+            'pharmacy_address': row['pharmacy_address'],
+            'pharmacy_phone': row['pharmacy_phone'],
+            'price': row['min_price'],
+            'quantity': row['total_quantity'],
+            'updated_at': row['last_updated_at'],
+            'manufacturer': row['manufacturers'][0] if row['manufacturers'] else None,
+            'country': row['countries'][0] if row['countries'] else None,
+            'pharmacies': row['pharmacies'],
+        }
+        for row in rows[:size]
+    ]
+    next_after = ''
+    if len(rows) > size:
+        last = offers[-1]
+        next_after = encode_after({
+            'price': str(last['price']),
+            'name': last['name'],
+            'form': last['form'],
+            'pharmacy': str(last['pharmacy_id']),
+        })
+    return offers, next_after
+
+
+def product_pages(query='', city='', after=None, size=PRODUCTS_PAGE_SIZE):
+    """
+    Товары, сгруппированные по product_key (название, форма, производитель,
+    страна), с аптеками внутри по возрастанию цены. Страницы — after_key
+    composite-агрегации, как в product_groups: дальняя страница стоит как
+    первая, в памяти только одна страница, контекст поиска между запросами
+    не держится. Аптек на товар не больше SEARCH_PHARMACIES_PER_PRODUCT,
+    остальные листаются через product_offers (флаг more_pharmacies).
+    Возвращает (товары, after следующей страницы или '').
+    """
+    filters = []
+    if city:
+        filters.append(city_filter(city))
+    body = {
+        "size": 0,
+        "query": {"bool": {"must": [name_query(query)] if query else [], "filter": filters}},
+        "aggs": {
+            "products": {
+                "composite": {
+                    "size": size,
+                    "sources": [{"key": {"terms": {"field": "product_key"}}}],
+                },
+                "aggs": {
+                    "pharmacies": {"top_hits": {
+                        "size": settings.SEARCH_PHARMACIES_PER_PRODUCT,
+                        "sort": [{"price": "asc"}],
+                        "_source": [
+                            "name", "form", "manufacturer", "country",
+                            "price", "quantity", "pharmacy.name", "pharmacy.pharmacy_number", "pharmacy.city",
+                        ],
+                    }},
+                },
+            },
+        },
+    }
+    if after:
+        body["aggs"]["products"]["composite"]["after"] = after
+
+    response = elastic.search(index=INDEX_ALIAS, body=body)
+    aggregation = response["aggregations"]["products"]
+    products = [_product_from_bucket(bucket) for bucket in aggregation["buckets"]]
+    next_after = ''
+    # Неполная страница — последняя, даже если ES вернул after_key
+    if len(products) == size:
+        next_after = encode_after(aggregation.get("after_key"))
+    return products, next_after
+
+
+def _product_from_bucket(bucket):
+    """Бакет composite-агрегации product_pages -> товар с аптеками"""
+    hits = [hit["_source"] for hit in bucket["pharmacies"]["hits"]["hits"]]
+    source = hits[0] if hits else {}
+    # doc_count — все предложения товара, top_hits вернул не больше лимита
+    total = bucket.get("doc_count", len(hits))
+    return {
+        "name": source.get("name", "N/A"),
+        "form": source.get("form", "N/A"),
+        "manufacturer": source.get("manufacturer", "N/A"),
+        "country": source.get("country", "N/A"),
+        "pharmacies": [
+            {
+                "pharmacy_city": hit.get("pharmacy", {}).get("city", "Unknown"),
+                "pharmacy_name": hit.get("pharmacy", {}).get("name", "Unknown"),
+                "pharmacy_number": hit.get("pharmacy", {}).get("pharmacy_number", ""),
+                "price": hit.get("price"),
+                "quantity": hit.get("quantity"),
+            }
+            for hit in hits
+        ],
+        "pharmacies_total": total,
+        "more_pharmacies": total > len(hits),
+    }
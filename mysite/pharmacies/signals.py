@@ -1,42 +1,61 @@
 # signals.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
+from .inventory import record_changes
 from .models import Product, Pharmacy
-from .tasks import update_elasticsearch_index, update_pharmacy_city_in_index
 
+_suppressed = ContextVar('index_signals_suppressed', default=False)
 
-@receiver(pre_delete, sender=Pharmacy)
-def store_pharmacy_products(sender, instance, **kwargs):
-    # Используем итератор для экономии памяти
-    instance._product_uuids = [
-        str(uuid) for uuid in 
-        instance.products.values_list('uuid', flat=True).iterator(chunk_size=3000)
-    ]
+
+@contextmanager
+def suppress_index_signals():
+    """Отключает синхронизацию индекса из сигналов (массовые загрузки индексируют сами)"""
+    token = _suppressed.set(True)
+    try:
+        yield
+    finally:
+        _suppressed.reset(token)
 
 
+def index_signals_suppressed():
+    return _suppressed.get()
+
 
 @receiver(post_save, sender=Product)
-def update_product_in_index(sender, instance, **kwargs):    
+def update_product_in_index(sender, instance, **kwargs):
     """Обновляет продукт в индексе при сохранении"""
-    update_elasticsearch_index.delay()
+    if index_signals_suppressed():
+        return
+    record_changes('product', [instance.pk], 'upsert')
 
 @receiver(post_delete, sender=Product)
 def delete_product_from_index(sender, instance, **kwargs):
-    """Удаляет продукт из индекса"""
-    update_elasticsearch_index.delay()
+    """Удаляет продукт из индекса (в том числе при каскадном удалении аптеки)"""
+    if index_signals_suppressed():
+        return
+    record_changes('product', [instance.pk], 'delete')
 
 @receiver(post_save, sender=Pharmacy)
 def update_pharmacy_index(sender, instance, **kwargs):
     """Обновляет индексы продуктов при изменении аптеки"""
-    if 'city' in (kwargs.get('update_fields') or []) or kwargs.get('created', False):
-        update_pharmacy_city_in_index.delay(instance.name, str(instance.pharmacy_number))
-    else:
-        update_elasticsearch_index.delay()
-
-@receiver(post_delete, sender=Pharmacy)
-def delete_pharmacy_index(sender, instance, **kwargs):
-    """Удаляет продукты аптеки из индекса"""
-    from .tasks import remove_products_from_index
-    remove_products_from_index.delay(getattr(instance, '_product_uuids', []))
-
-    
\ No newline at end of file
+    if index_signals_suppressed() or kwargs.get('created', False):
+        # У новой аптеки ещё нет товаров
+        return
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not set(update_fields) & set(Pharmacy.INDEXED_FIELDS):
+        return
+    if not instance.indexed_fields_changed():
+        # Телефон, адрес и часы работы в индексе не хранятся
+        return
+    instance._indexed_snapshot = instance.indexed_values()
+    record_changes('pharmacy', [instance.pk], 'upsert')
+
+@receiver(pre_delete, sender=Pharmacy)
+def delete_pharmacy_from_index(sender, instance, **kwargs):
+    """Удаление аптеки в обход inventory.delete_pharmacy: документы снимаются по pharmacy.id"""
+    if index_signals_suppressed():
+        return
+    record_changes('pharmacy', [instance.pk], 'delete')
@@ -1,9 +1,18 @@
-from celery import shared_task
-from django.utils import timezone
-from elasticsearch import Elasticsearch, helpers
-from .models import Product
+from contextlib import contextmanager
+
+from celery import chord, shared_task
+from django.db import connection, transaction
+from elasticsearch import helpers
+from .models import IndexChange, Product
+from .bulk_serializer import (
+    PRODUCT_COLUMNS, PharmacyDocuments, ndjson_chunks, delete_lines, send_body, send_chunks
+)
 from .documents import ProductDocument
-from elasticsearch.connection import RequestsHttpConnection
+from .search_index import (
+    INDEX_ALIAS, BUILDING_INDEX_KEY, BUILDING_INDEX_TTL, REFRESH_SCHEDULED_KEY, refresh_kwargs, changes_applied,
+    ensure_index, write_targets, start_build, finish_build, swap_alias, prune_versions, index_created_at
+)
+from .elastic import get_client
 
 
 
@@ -52,21 +61,6 @@ logger = logging.getLogger(__name__)
 
 
 
-es_client = Elasticsearch(
-    hosts=["http://elasticsearch-node-1:9200"],
-    http_auth=("elastic", "elastic"),
-    connection_class=RequestsHttpConnection,
-    timeout=30,
-    max_retries=10,
-    retry_on_timeout=True
-)
-
-# Проверка соединения при старте
-try:
-    if not es_client.ping():
-        raise ValueError("Cannot connect to Elasticsearch")
-except Exception as e:
-    print(f"Elasticsearch connection error: {str(e)}")
 
 
 # @shared_task
@@ -106,147 +100,408 @@ except Exception as e:
 #     return True
 
 
+# Сколько записей outbox забирает один проход drain_index_changes
+DRAIN_BATCH_SIZE = 5000
+# Опрос фоновых задач ES (update_by_query аптеки): интервал в секундах и число попыток
+ES_TASK_POLL_INTERVAL = 10
+ES_TASK_POLL_RETRIES = 360
+# Ключ advisory-блокировки разбора outbox: форма из двух int не пересекается
+# с bigint-ключами аптек из inventory.pharmacy_load_lock
+DRAIN_LOCK_KEY = (7305, 1)
+
+
+INDEX_DRAIN_SCHEDULED_KEY = 'index_drain_scheduled'
+
+
+def request_index_drain():
+    """
+    Ставит разбор outbox не чаще раза за INDEX_SYNC_DEBOUNCE секунд:
+    всё, что закоммичено до его старта, он заберёт одной пачкой.
+    """
+    window = settings.INDEX_SYNC_DEBOUNCE
+    # False — разбор уже поставлен; None — Redis недоступен (IGNORE_EXCEPTIONS), ставим без дедупликации
+    if cache.add(INDEX_DRAIN_SCHEDULED_KEY, 1, timeout=max(window * 10, 60)) is not False:
+        drain_index_changes.apply_async(countdown=window)
+
+
+def schedule_index_drain():
+    """
+    Один on_commit на транзакцию, сколько бы строк в ней ни изменилось.
+    При откате транзакции (или точки сохранения) колбэк снимается самим Django.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(
+        entry[1] is request_index_drain for entry in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(request_index_drain)
+
+
+def _coalesce_changes(claimed):
+    """Последняя операция по каждому объекту побеждает (claimed упорядочены по id)"""
+    latest = {}
+    for entity, object_id, op in claimed:
+        latest[(entity, object_id)] = op
+    product_upserts, product_deletes, pharmacy_upserts = [], [], []
+    for (entity, object_id), op in latest.items():
+        if entity == 'pharmacy':
+            if op == 'upsert':
+                pharmacy_upserts.append(object_id)
+        elif op == 'upsert':
+            product_upserts.append(object_id)
+        else:
+            product_deletes.append(object_id)
+    # Очистку аптеки не отменяет последующий upsert её данных: применяются обе
+    pharmacy_deletes = list(dict.fromkeys(
+        object_id for entity, object_id, op in claimed if entity == 'pharmacy' and op == 'delete'
+    ))
+    return product_upserts, product_deletes, pharmacy_upserts, pharmacy_deletes
+
+
+def delete_pharmacy_documents(es, targets, pharmacy_uuids):
+    """
+    Удаляет документы аптек через delete_by_query по pharmacy.id (со slices),
+    без списка UUID товаров. Выполняется синхронно: вставки из той же пачки
+    outbox идут после и не должны попасть под удаление, а вставки следующих
+    пачек ждут drain_lock.
+    """
+    index = ','.join(targets)
+    # Недавние записи ещё не видны поиску, а delete_by_query удаляет только видимое
+    es.indices.refresh(index=index)
+    deleted, failed = 0, []
+    for pharmacy_uuid in pharmacy_uuids:
+        response = es.delete_by_query(
+            index=index,
+            body={"query": {"term": {"pharmacy.id": str(pharmacy_uuid)}}},
+            conflicts='proceed',
+            slices='auto',
+            refresh=True,
+            request_timeout=600,
+        )
+        deleted += response.get('deleted', 0)
+        for failure in response.get('failures', [])[:10]:
+            logger.error(f"ES delete_by_query failed: {failure}")
+        if response.get('failures'):
+            failed.append(str(pharmacy_uuid))
+    if failed:
+        # Вставки после неполной очистки нельзя подтверждать: пачка повторится целиком
+        raise RuntimeError(f"delete_by_query failed for pharmacies {', '.join(failed)}")
+    return deleted
+
+
+def _failed_ids(errors):
+    """_id документов из ошибок bulk"""
+    return {next(iter(item.values())).get('_id') for item in errors}
+
+
+def _apply_changes(es, targets, product_upserts, product_deletes, pharmacy_upserts,
+                   pharmacy_deletes=(), wait_for=False):
+    """Отправляет изменения; возвращает (применено, id товаров с ошибкой)"""
+    applied, failed = 0, []
+    if pharmacy_deletes:
+        applied += delete_pharmacy_documents(es, targets, pharmacy_deletes)
+
+    rows = list(Product.objects.live().filter(uuid__in=product_upserts).values_list(*PRODUCT_COLUMNS))
+    found = {row[0] for row in rows}
+    # Строки, которых уже нет среди активных, из индекса убираем
+    deletes = product_deletes + [object_id for object_id in product_upserts if object_id not in found]
+
+    for success, errors, _ in send_chunks(
+        es, ndjson_chunks(rows, targets, PharmacyDocuments()), thread_count=1, **refresh_kwargs(wait_for)
+    ):
+        applied += success
+        failed += errors
+    for chunk in chunked(deletes, 2000):
+        success, errors = send_body(es, delete_lines(chunk, targets), **refresh_kwargs(wait_for))
+        applied += success
+        failed += errors
+    for error in failed[:10]:
+        logger.error(f"ES sync failed: {error}")
+    # Данные аптеки меняются на стороне ES, по одной задаче на аптеку
+    for pharmacy_uuid in pharmacy_upserts:
+        update_pharmacy_in_index.delay(str(pharmacy_uuid))
+    return applied, _failed_ids(failed)
+
+
+@shared_task
+def refresh_index():
+    """Отложенный refresh от координатора (search_index.changes_applied)"""
+    cache.delete(REFRESH_SCHEDULED_KEY)
+    get_client().indices.refresh(index=INDEX_ALIAS)
+    return f"Refreshed {INDEX_ALIAS}"
+
+
+@contextmanager
+def drain_lock():
+    """
+    Сессионная advisory-блокировка разбора outbox. Разборы идут по одному:
+    иначе очистка аптеки из одной пачки могла бы выполниться после вставки
+    её новых товаров из следующей пачки другим воркером и удалить их.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", DRAIN_LOCK_KEY)
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", DRAIN_LOCK_KEY)
+
+
+@shared_task
+def drain_index_changes(batch_size=DRAIN_BATCH_SIZE, wait_for=False):
+    """
+    Применяет outbox IndexChange к Elasticsearch пачками по порядку id:
+    схлопывает повторы по одному id, отправляет изменения и только потом
+    удаляет применённые записи (чекпоинт). Запросы в ES идут вне транзакции,
+    порядок между пачками держит drain_lock. При ошибке пачка остаётся в
+    очереди и повторяется целиком; записи товаров, которые ES отклонил
+    (например, 429), остаются до следующего разбора.
+    """
+    # Изменения, закоммиченные после этой точки, поставят следующий разбор
+    cache.delete(INDEX_DRAIN_SCHEDULED_KEY)
+
+    with drain_lock() as acquired:
+        if not acquired:
+            # Идущий разбор после снятия блокировки проверит, не осталось ли записей
+            return {"applied": 0, "failed": 0, "skipped": True}
+        applied, failed = _drain_batches(batch_size, wait_for)
+    # Записи, ради которых поставили пропущенный разбор, могли не попасть в последнюю пачку
+    if not failed and IndexChange.objects.exists():
+        request_index_drain()
+    return {"applied": applied, "failed": failed}
+
+
+def _drain_batches(batch_size, wait_for):
+    es = get_client()
+    ensure_index(es)
+    # Во время переиндексации изменения пишутся и в строящийся индекс
+    targets = write_targets(es)
+
+    applied, failed = 0, 0
+    while True:
+        claimed = list(
+            IndexChange.objects.order_by('id').values_list('id', 'entity', 'object_id', 'op')[:batch_size]
+        )
+        if not claimed:
+            break
+        batch_applied, failed_ids = _apply_changes(
+            es, targets, *_coalesce_changes([row[1:] for row in claimed]), wait_for=wait_for
+        )
+        # Чекпоинт: удаляются записи, применённые без ошибок
+        IndexChange.objects.filter(id__in=[
+            change_id for change_id, entity, object_id, _ in claimed
+            if entity != 'product' or str(object_id) not in failed_ids
+        ]).delete()
+        applied += batch_applied
+        failed += len(failed_ids)
+        # Отклонённые записи повторит следующий разбор, а не этот же цикл
+        if failed_ids or len(claimed) < batch_size:
+            break
+
+    if applied:
+        changes_applied(wait_for)
+    return applied, failed
+
+
 @shared_task
 def update_elasticsearch_index():
-    """Частичное обновление индекса Elasticsearch для измененных продуктов"""
-    es = es_client
+    """Оставлена для уже поставленных задач: синхронизация идёт через outbox"""
+    return drain_index_changes()
 
-    
-    index_name = ProductDocument.Index.name
 
-    if not es.indices.exists(index=index_name):
-        ProductDocument.init(using=es)
-        
-    chunk_size = 1000
-    
+@shared_task
+def full_elasticsearch_resync():
+    """
+    Полная переиндексация blue/green: новый индекс products-<время> без реплик
+    и refresh, параллельная заливка по аптекам (подзадачи reindex_partition),
+    затем complete_reindex переключает алиас. Старый индекс остаётся для отката.
+    """
+    from .reindex import plan_partitions
+
+    es = get_client()
+    ensure_index(es)
+
+    index_name = start_build(es)
+    partition_ids = plan_partitions(index_name)
+    chord(reindex_partition.s(partition_id) for partition_id in partition_ids)(
+        complete_reindex.si(index_name)
+    )
+    return f"Reindex into {index_name} started: {len(partition_ids)} partitions"
 
-    last_update = timezone.now() - timezone.timedelta(minutes=2)
-    products = Product.objects.filter(updated_at__gte=last_update).select_related('pharmacy')
 
-    total_updated = 0
-    for i in range(0, products.count(), chunk_size):
-        chunk = products[i:i + chunk_size]
-        actions = [
-            {
-                "_op_type": "index",
-                "_index": index_name,
-                "_id": str(product.uuid),  # Используем UUID вместо ID
-                "_source": ProductDocument().to_dict(product),
-            }
-            for product in chunk
-        ]
-        if actions:
-            helpers.bulk(es, actions)
-            total_updated += len(actions)
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def reindex_partition(self, partition_id):
+    """Заливает товары одной аптеки, при ошибке продолжает с последнего чекпоинта"""
+    from .models import ReindexPartition
+    from .reindex import run_partition
 
-    if total_updated > 0:
-        es.indices.refresh(index=index_name)
+    partition = ReindexPartition.objects.get(id=partition_id)
+    if partition.status == 'completed':
+        return partition.indexed
+    try:
+        return run_partition(get_client(), partition)
+    except Exception as e:
+        raise self.retry(exc=e)
 
-    return f"Updated {total_updated} products in Elasticsearch"
+
+@shared_task
+def complete_reindex(index_name):
+    """Догонка изменений, настройки рабочего индекса, forcemerge и переключение алиаса"""
+    from .reindex import catch_up, partition_progress
+
+    es = get_client()
+    progress = partition_progress(index_name)
+    if progress['completed'] != progress['partitions']:
+        return f"Reindex into {index_name} is incomplete: {progress}, run resume_reindex"
+
+    # Всё, что изменилось с момента создания индекса
+    caught_up, removed = catch_up(es, index_name, index_created_at(es, index_name))
+    finish_build(es, index_name)
+    previous = swap_alias(es, index_name)
+    prune_versions(es)
+    return (
+        f"Resynced {progress['indexed']} products into {index_name} "
+        f"({progress['failed']} failed, {caught_up} caught up, {removed} removed), "
+        f"previous: {', '.join(previous) or 'none'}"
+    )
 
 
 @shared_task
-def full_elasticsearch_resync():
-    """Полная синхронизация индекса Elasticsearch"""
-    es = es_client
-    
-    index_name = ProductDocument.Index.name
+def resume_reindex(index_name):
+    """Перезапускает незавершённые части переиндексации, готовые не трогает"""
+    from .models import ReindexPartition
 
-    if not es.indices.exists(index=index_name):
-        ProductDocument.init(using=es)
+    partition_ids = list(
+        ReindexPartition.objects.filter(index_name=index_name)
+        .exclude(status='completed').values_list('id', flat=True)
+    )
+    cache.set(BUILDING_INDEX_KEY, index_name, BUILDING_INDEX_TTL)
+    chord(reindex_partition.s(partition_id) for partition_id in partition_ids)(
+        complete_reindex.si(index_name)
+    )
+    return f"Resumed {len(partition_ids)} partitions of {index_name}"
 
-    
 
-    products = Product.objects.all()
-    total_resynced = 0
-    chunk_size = 1000
-    chunk = []
-    for product in products:
-        chunk.append(product)
-        if len(chunk) == chunk_size:
-            actions = [
-                {
-                    "_op_type": "index",
-                    "_index": ProductDocument.Index.name,
-                    "_id": str(product.uuid),  # Используем UUID вместо ID
-                    "_source": ProductDocument().to_dict(product),
-                }
-                for product in chunk
-            ]
-            helpers.bulk(es, actions)
-            chunk = []
-            total_resynced += len(actions)
-
-    if chunk:
-        actions = [
-            {
-                "_op_type": "index",
-                "_index": ProductDocument.Index.name,
-                "_id": str(product.uuid),  # Используем UUID вместо ID
-                "_source": ProductDocument().to_dict(product),
-            }
-            for product in chunk
-        ]
-        helpers.bulk(es, actions)
-        total_resynced += len(actions)
-
-    es.indices.refresh(index=index_name)
-    return f"Resynced {total_resynced} products in Elasticsearch"
+PHARMACY_UPDATE_TASK_KEY = 'pharmacy_index_update:{}'
+
+# Painless: подменяем только вложенный документ аптеки, остальное не трогаем
+PHARMACY_UPDATE_SCRIPT = (
+    "if (ctx._source.pharmacy == params.pharmacy) { ctx.op = 'noop' } "
+    "else { ctx._source.pharmacy = params.pharmacy }"
+)
 
 
 @shared_task
-def update_pharmacy_city_in_index(pharmacy_name, pharmacy_number):
-    from .models import Pharmacy, Product
-    from .documents import ProductDocument
+def update_pharmacy_in_index(pharmacy_uuid):
+    """
+    Переписывает pharmacy.* во всех документах аптеки через update_by_query
+    по pharmacy.id, без выборки товаров из Postgres. Запрос выполняется
+    в ES асинхронно с ограничением скорости; id задачи ES хранится в кэше,
+    предыдущая незавершённая задача той же аптеки отменяется.
+    """
+    from .bulk_serializer import pharmacy_document
+    from .models import Pharmacy
+
+    es = get_client()
+    ensure_index(es)
+
+    pharmacy = Pharmacy.objects.filter(uuid=pharmacy_uuid).first()
+    if not pharmacy:
+        return f"Pharmacy {pharmacy_uuid} not found"
+
+    key = PHARMACY_UPDATE_TASK_KEY.format(pharmacy_uuid)
+    previous = cache.get(key)
+    if previous:
+        es.tasks.cancel(task_id=previous, ignore=[404])
+
+    response = es.update_by_query(
+        index=','.join(write_targets(es)),
+        body={
+            "query": {"term": {"pharmacy.id": str(pharmacy.uuid)}},
+            "script": {
+                "source": PHARMACY_UPDATE_SCRIPT,
+                "lang": "painless",
+                "params": {"pharmacy": pharmacy_document(
+                    pharmacy.uuid, pharmacy.name, pharmacy.pharmacy_number, pharmacy.city
+                )},
+            },
+        },
+        conflicts='proceed',
+        slices='auto',
+        requests_per_second=settings.PHARMACY_UPDATE_RPS,
+        wait_for_completion=False,
+    )
+    cache.set(key, response['task'], timeout=3600)
+    # Документы переписываются в фоне: refresh имеет смысл только после задачи ES
+    refresh_after_es_task.apply_async(args=[response['task']], countdown=ES_TASK_POLL_INTERVAL)
+    return {"pharmacy": str(pharmacy.uuid), "task": response['task']}
 
-    es = es_client
-    
 
-    index_name = ProductDocument.Index.name
+@shared_task(bind=True, max_retries=ES_TASK_POLL_RETRIES)
+def refresh_after_es_task(self, es_task_id):
+    """Ждёт завершения фоновой задачи ES (update_by_query) и ставит refresh"""
+    status = get_client().tasks.get(task_id=es_task_id, ignore=[404])
+    if status.get('status') == 404 or 'task' not in status:
+        return f"ES task {es_task_id} not found"
+    if not status.get('completed'):
+        raise self.retry(countdown=ES_TASK_POLL_INTERVAL)
+    changes_applied()
+    return f"ES task {es_task_id} completed"
 
-    if not es.indices.exists(index=index_name):
-        ProductDocument.init(using=es)
 
-    
+def pharmacy_update_status(pharmacy_uuid):
+    """Состояние последнего update_by_query аптеки (ответ tasks API) или None"""
+    task_id = cache.get(PHARMACY_UPDATE_TASK_KEY.format(pharmacy_uuid))
+    if not task_id:
+        return None
+    return get_client().tasks.get(task_id=task_id, ignore=[404])
 
-    try:
-        # Ищем аптеку по имени и номеру (оба параметра как строки)
-        pharmacy = Pharmacy.objects.filter(
-            name=pharmacy_name,
-            pharmacy_number=str(pharmacy_number)  # Гарантируем строковый тип
-        ).first()
-
-        if not pharmacy:
-            # Попробуем найти без учета регистра для имени
-            pharmacy = Pharmacy.objects.filter(
-                name__iexact=pharmacy_name,
-                pharmacy_number=str(pharmacy_number)
-            ).first()
-            if not pharmacy:
-                return f"Pharmacy '{pharmacy_name}' with number {pharmacy_number} not found."
-
-        # Получаем продукты с select_related
-        products = Product.objects.filter(pharmacy=pharmacy).select_related('pharmacy')
-
-        if not products.exists():
-            return f"No products found for pharmacy '{pharmacy.name}' (#{pharmacy.pharmacy_number})"
-
-        # Подготовка данных для Elasticsearch
-        actions = [{
-            "_op_type": "index",
-            "_index": index_name,
-            "_id": str(product.uuid),
-            "_source": ProductDocument().to_dict(product),
-        } for product in products]
 
-        # Пакетное обновление
-        helpers.bulk(es, actions)
-        es.indices.refresh(index=index_name)
+@shared_task
+def update_pharmacy_city_in_index(pharmacy_name, pharmacy_number, wait_for=False):
+    """Оставлена для уже поставленных задач: см. update_pharmacy_in_index"""
+    from .models import Pharmacy
 
-        return f"Updated {len(actions)} products for pharmacy '{pharmacy.name}' (#{pharmacy.pharmacy_number})"
+    pharmacy = Pharmacy.objects.filter(
+        name__iexact=pharmacy_name,
+        pharmacy_number=str(pharmacy_number)
+    ).first()
+    if not pharmacy:
+        return f"Pharmacy '{pharmacy_name}' with number {pharmacy_number} not found."
+    return update_pharmacy_in_index(str(pharmacy.uuid))
+
+
+@shared_task
+def bump_search_generation(city):
+    """Отложенный сброс кэша результатов города (result_cache.invalidate_city)"""
+    from .result_cache import bump_generation
+    bump_generation(city)
+    return f"Search cache generation bumped for {city or 'all cities'}"
+
+
+@shared_task(bind=True, max_retries=10)
+def purge_stale_products(self, pharmacy_uuid):
+    """
+    Удаляет пачками строки поколений старше активного после теневой загрузки.
+    Под блокировкой загрузки аптеки: если идёт следующая загрузка, задача
+    откладывается, а не удаляет уже записанные строки нового поколения.
+    """
+    from .inventory import PURGE_DELAY, PharmacyLoadInProgress, pharmacy_load_lock, purge_stale_generations
+    from .models import Pharmacy
+
+    pharmacy = Pharmacy.objects.filter(uuid=pharmacy_uuid).first()
+    if not pharmacy:
+        return f"Pharmacy {pharmacy_uuid} not found"
+    try:
+        with pharmacy_load_lock(pharmacy):
+            pharmacy.refresh_from_db(fields=['active_generation'])
+            purged = purge_stale_generations(pharmacy, older_only=True)
+    except PharmacyLoadInProgress as e:
+        raise self.retry(exc=e, countdown=PURGE_DELAY)
+    return f"Purged {purged} stale products of {pharmacy}"
 
-    except Exception as e:
-        return f"Error updating products: {str(e)}"
 
 def chunked(iterable, size):
     """Разбивает итерируемый объект на чанки заданного размера."""
@@ -254,12 +509,9 @@ def chunked(iterable, size):
         yield iterable[i:i + size]
 
 @shared_task
-def remove_products_from_index(product_uuids):
-    """Удаляет продукты по их UUID из индекса"""
-    es = es_client
-    if not es:
-        logger.error("Elasticsearch client not available")
-        return
+def remove_products_from_index(product_uuids, wait_for=False):
+    """Удаляет продукты по их UUID из индекса (отдельные товары; аптеку целиком — remove_pharmacy_from_index)"""
+    es = get_client()
 
     index_name = ProductDocument.Index.name
 
@@ -278,14 +530,22 @@ def remove_products_from_index(product_uuids):
                 }
                 for uuid in chunk
             ]
-            helpers.bulk(es, actions)
-        
-        es.indices.refresh(index=index_name)
+            helpers.bulk(es, actions, **refresh_kwargs(wait_for))
+
+        changes_applied(wait_for)
         return f"Removed {len(product_uuids)} products from index"
     except Exception as e:
         logger.error(f"Error removing products: {str(e)}")
         return f"Error removing products: {str(e)}"
 
+@shared_task
+def remove_pharmacy_from_index(pharmacy_uuid):
+    """Удаляет все документы аптеки из индекса (delete_by_query по pharmacy.id)"""
+    es = get_client()
+    deleted = delete_pharmacy_documents(es, write_targets(es), [pharmacy_uuid])
+    return f"Removed {deleted} products of pharmacy {pharmacy_uuid} from index"
+
+
 # @shared_task
 # def remove_pharmacy_products_from_index(pharmacy_uuid):
 #     """Удаляет все продукты аптеки из индекса"""
@@ -334,16 +594,15 @@ def remove_products_from_index(product_uuids):
 
 # В tasks.py добавьте обработку ошибок и прогрессивную индексацию
 @shared_task
-def bulk_update_elasticsearch(product_uuids):
-    es = es_client
+def bulk_update_elasticsearch(product_uuids, wait_for=False):
+    es = get_client()
 
     index_name = ProductDocument.Index.name
 
     if not product_uuids or not es.ping():
         return {"status": "skipped", "reason": "No data or ES unavailable"}
 
-    if not es.indices.exists(index=index_name):
-        ProductDocument.init(using=es)
+    ensure_index(es)
 
     actions = (
         {
@@ -352,7 +611,7 @@ def bulk_update_elasticsearch(product_uuids):
             "_id": str(product.uuid),
             "_source": ProductDocument().to_dict(product)
         }
-        for product in Product.objects.filter(uuid__in=product_uuids).iterator(chunk_size=5000)
+        for product in Product.objects.live().filter(uuid__in=product_uuids).iterator(chunk_size=5000)
     )
 
     try:
@@ -363,7 +622,8 @@ def bulk_update_elasticsearch(product_uuids):
             actions,
             chunk_size=5000,
             thread_count=4,
-            request_timeout=60
+            request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT,
+            **refresh_kwargs(wait_for)
         ):
             if ok:
                 success += 1
@@ -371,7 +631,7 @@ def bulk_update_elasticsearch(product_uuids):
                 failed += 1
                 logger.error(f"ES indexing failed: {result}")
 
-        es.indices.refresh(index=index_name)
+        changes_applied(wait_for)
         return {
             "status": "success",
             "indexed": success,
@@ -1,3 +1,299 @@
-from django.test import TestCase
+import os
+import tempfile
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal
 
-# Create your tests here.
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from .elastic import CircuitBreaker
+from .inventory import plan_reconcile, product_fingerprint
+from .loaders import copy_products
+from .metrics import summarize_tasks
+from .models import Pharmacy, Product
+from .normalization import CSV_FIELDNAMES, normalize_row, parse_date, parse_decimal
+from .result_cache import ALL_CITIES, city_key
+from .signals import suppress_index_signals
+from .search_service import _after_offer, _product_from_bucket, decode_after, encode_after
+from .tasks import _coalesce_changes, _failed_ids
+from .uploads import iter_csv_file_rows, split_ranges
+
+
+class ParseDateTests(SimpleTestCase):
+    def test_valid(self):
+        self.assertEqual(parse_date('05.03.2027'), date(2027, 3, 5))
+        self.assertEqual(parse_date('5.3.2027'), date(2027, 3, 5))
+
+    def test_malformed(self):
+        for value in ['', '2027-03-05', '31.02.2027', '05.13.2027', '05.03', 'aa.bb.cccc', ' 05.03.2027', '05.03.2027.1',
+                      '05.03.27', '05.03.202', '005.03.2027', '05.03.2027\n', '٠٥.٠٣.٢٠٢٧']:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_date(value)
+
+
+class ParseDecimalTests(SimpleTestCase):
+    def test_valid(self):
+        self.assertEqual(parse_decimal('12,50'), Decimal('12.50'))
+        self.assertEqual(parse_decimal('0.1'), Decimal('0.1'))
+        self.assertEqual(parse_decimal('7'), Decimal('7'))
+
+    def test_empty_uses_default(self):
+        self.assertIsNone(parse_decimal(''))
+        self.assertEqual(parse_decimal('', Decimal('0')), Decimal('0'))
+
+    def test_malformed(self):
+        for value in ['abc', '1,2,3', '12.5р', 'NaN', 'inf', '-Infinity']:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_decimal(value)
+
+
+class SummarizeTasksTests(SimpleTestCase):
+    def task(self, number, status, rows_per_sec, day=1):
+        return {
+            'pharmacy_name': 'novamedika', 'pharmacy_number': number, 'status': status,
+            'created_at': datetime(2026, 1, day),
+            'result': {'rows_read': 100, 'rows_per_sec': rows_per_sec, 'wall_time': 1.0,
+                       'phases': {'parse': 0.5, 'db_write': 0.5}},
+        }
+
+    def test_slowest_pharmacy_first(self):
+        summary = summarize_tasks([
+            self.task('1', 'completed', 5000.0),
+            self.task('2', 'completed', 100.0),
+            self.task('2', 'failed', None, day=2),
+        ])
+        slowest = summary['pharmacies'][0]
+        self.assertEqual(slowest['pharmacy_number'], '2')
+        self.assertEqual((slowest['runs'], slowest['completed'], slowest['failed']), (2, 1, 1))
+        self.assertEqual([day['date'] for day in summary['days']], ['2026-01-01', '2026-01-02'])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(threshold=2, reset_after=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertTrue(breaker.is_open)
+
+    def test_single_trial_after_reset(self):
+        breaker = CircuitBreaker(threshold=1, reset_after=30)
+        with mock.patch('pharmacies.elastic.time.monotonic', return_value=100.0):
+            breaker.record_failure()
+        with mock.patch('pharmacies.elastic.time.monotonic', return_value=131.0):
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+
+class AfterKeyTests(SimpleTestCase):
+    def test_round_trip(self):
+        after_key = {'name': 'парацетамол', 'city': 'Минск'}
+        self.assertEqual(decode_after(encode_after(after_key)), after_key)
+
+    def test_garbage_is_first_page(self):
+        for value in ['', 'not-base64!', encode_after({'name': 'x'}), 'W10=']:
+            with self.subTest(value=value):
+                self.assertIsNone(decode_after(value))
+
+    def test_offer_key_with_bad_values_is_first_page(self):
+        valid = {'price': '10.50', 'name': 'Аспирин', 'form': 'ТАБЛ', 'pharmacy': 'b0a9e1f2-3c4d-4e5f-8a9b-0c1d2e3f4a5b'}
+        self.assertIsNotNone(_after_offer(valid))
+        for key, value in [('pharmacy', 'not-a-uuid'), ('pharmacy', ''), ('price', 'abc'), ('price', 10)]:
+            with self.subTest(key=key, value=value):
+                self.assertIsNone(_after_offer(dict(valid, **{key: value})))
+
+
+class ProductBucketTests(SimpleTestCase):
+    def bucket(self, doc_count, returned):
+        hits = [{'_source': {'name': 'Аспирин', 'form': 'ТАБЛ', 'price': 1, 'pharmacy': {'name': 'Аптека'}}}] * returned
+        return {'key': {'key': 'аспирин|табл'}, 'doc_count': doc_count, 'pharmacies': {'hits': {'hits': hits}}}
+
+    def test_cut_off_pharmacies_are_flagged(self):
+        product = _product_from_bucket(self.bucket(150, 100))
+        self.assertEqual(len(product['pharmacies']), 100)
+        self.assertEqual(product['pharmacies_total'], 150)
+        self.assertTrue(product['more_pharmacies'])
+
+    def test_all_pharmacies_returned(self):
+        product = _product_from_bucket(self.bucket(3, 3))
+        self.assertEqual(product['pharmacies_total'], 3)
+        self.assertFalse(product['more_pharmacies'])
+
+
+class CityKeyTests(SimpleTestCase):
+    def test_all_cities(self):
+        for value in ['', '  ', 'Все города', None]:
+            with self.subTest(value=value):
+                self.assertEqual(city_key(value), ALL_CITIES)
+
+    def test_case_insensitive(self):
+        self.assertEqual(city_key(' Минск '), city_key('минск'))
+
+
+def product_values(name='Аспирин', serial='A1', price='10.00', quantity='1.000', **extra):
+    values = {
+        'name': name, 'form': 'табл', 'manufacturer': 'Лекфарм', 'country': 'Беларусь',
+        'serial': serial, 'price': Decimal(price), 'quantity': Decimal(quantity), 'total_price': Decimal(price),
+        'expiry_date': date(2027, 3, 5), 'category': 'Лексредства', 'import_date': date(2026, 1, 1),
+        'internal_code': '1', 'wholesale_price': Decimal('9.00'), 'retail_price': Decimal('10.00'),
+        'distributor': 'd', 'internal_id': '1',
+    }
+    values.update(extra)
+    values['fingerprint'] = product_fingerprint(values)
+    return values
+
+
+class ProductFingerprintTests(SimpleTestCase):
+    def test_decimal_and_string_inputs_match(self):
+        base = product_values()
+        same = dict(base, price='10.0', quantity=1, wholesale_price=Decimal('9.000'))
+        self.assertEqual(product_fingerprint(same), base['fingerprint'])
+
+    def test_saved_product_matches_normalized_row(self):
+        row = dict.fromkeys(CSV_FIELDNAMES, '')
+        row.update({
+            'name': 'Аспирин', 'serial': 'A-1', 'price': '10,50', 'quantity': '2',
+            'expiry_date': '05.03.2027', 'category': 'Прочее', 'import_date': '01.01.2026',
+            'internal_code': '1', 'distributor': 'd', 'internal_id': '1',
+        })
+        for total_price in ['', '21,00']:
+            with self.subTest(total_price=total_price):
+                values = normalize_row(dict(row, total_price=total_price))
+                fingerprint = values.pop('fingerprint')
+                # Product.save() считает отпечаток по экземпляру с умолчаниями модели
+                self.assertEqual(product_fingerprint(Product(**values)), fingerprint)
+                if not total_price:
+                    values.pop('total_price')
+                    self.assertEqual(product_fingerprint(Product(**values)), fingerprint)
+
+    def test_changed_field_changes_fingerprint(self):
+        self.assertNotEqual(product_values(price='10.01')['fingerprint'], product_values()['fingerprint'])
+
+    def test_none_is_stable(self):
+        values = product_values(internal_code=None)
+        self.assertEqual(product_fingerprint(dict(values)), values['fingerprint'])
+
+
+class PlanReconcileTests(SimpleTestCase):
+    def current_row(self, product_uuid, values, fingerprint=None):
+        return (product_uuid, values['name'], values['serial'], values['expiry_date'],
+                fingerprint or values['fingerprint'])
+
+    def test_split(self):
+        kept, changed, gone = product_values(serial='K'), product_values(serial='C'), product_values(serial='G')
+        current = [
+            self.current_row('u-kept', kept),
+            self.current_row('u-changed', changed),
+            self.current_row('u-gone', gone),
+        ]
+        new = product_values(serial='N')
+        changed_now = product_values(serial='C', price='12.00')
+        to_create, to_update, deleted, unchanged = plan_reconcile(current, [kept, changed_now, new])
+        self.assertEqual(to_create, [new])
+        self.assertEqual(to_update, [('u-changed', changed_now)])
+        self.assertEqual(deleted, ['u-gone'])
+        self.assertEqual(unchanged, 1)
+
+    def test_historical_duplicates_deleted(self):
+        values = product_values()
+        current = [self.current_row('u-1', values), self.current_row('u-2', values)]
+        to_create, to_update, deleted, unchanged = plan_reconcile(current, [values])
+        self.assertEqual((to_create, to_update, deleted, unchanged), ([], [], ['u-2'], 1))
+
+    def test_empty_upload_deletes_everything(self):
+        current = [self.current_row('u-1', product_values())]
+        self.assertEqual(plan_reconcile(current, [])[2], ['u-1'])
+
+
+class CoalesceChangesTests(SimpleTestCase):
+    def test_last_operation_wins(self):
+        upserts, deletes, pharmacy_upserts, pharmacy_deletes = _coalesce_changes([
+            ('product', 'p1', 'upsert'),
+            ('product', 'p1', 'delete'),
+            ('product', 'p2', 'delete'),
+            ('product', 'p2', 'upsert'),
+        ])
+        self.assertEqual((upserts, deletes), (['p2'], ['p1']))
+        self.assertEqual((pharmacy_upserts, pharmacy_deletes), ([], []))
+
+    def test_pharmacy_delete_survives_later_upsert(self):
+        _, _, pharmacy_upserts, pharmacy_deletes = _coalesce_changes([
+            ('pharmacy', 'ph', 'delete'),
+            ('pharmacy', 'ph', 'upsert'),
+            ('pharmacy', 'ph', 'delete'),
+        ])
+        self.assertEqual(pharmacy_deletes, ['ph'])
+        self.assertEqual(pharmacy_upserts, [])
+
+    def test_failed_ids_from_bulk_errors(self):
+        errors = [
+            {'index': {'_index': 'products-1', '_id': 'p1', 'status': 429}},
+            {'delete': {'_index': 'products-2', '_id': 'p2', 'status': 503}},
+            {'index': {'_index': 'products-2', '_id': 'p1', 'status': 429}},
+        ]
+        self.assertEqual(_failed_ids(errors), {'p1', 'p2'})
+
+
+class CsvRangesTests(SimpleTestCase):
+    def setUp(self):
+        lines = []
+        for i in range(200):
+            # Каждая седьмая строка — дубликат предыдущей: правило «первая побеждает» через границы диапазонов
+            number = i - 1 if i % 7 == 0 and i else i
+            lines.append(
+                f"Аспирин {number} ТАБЛ 10;Байер;Германия;S{number};1{i % 10},50;2;;05.03.2027;Лексредства;"
+                f"01.01.2026;{i};;;Дистрибьютор;{i};1\r\n"
+            )
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w', encoding='utf-8', newline='') as f:
+            f.write(''.join(lines))
+        self.addCleanup(os.remove, self.path)
+
+    def test_split_ranges_cover_file_on_line_boundaries(self):
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for parts in (1, 2, 3, 7, 500):
+            with self.subTest(parts=parts):
+                ranges = split_ranges(self.path, parts)
+                self.assertEqual(ranges[0][0], 0)
+                self.assertEqual(ranges[-1][1], size)
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+                    self.assertEqual(data[start - 1:start], b'\n')
+
+    @mock.patch('pharmacies.uploads._in_daemon_process', return_value=False)
+    @mock.patch('pharmacies.uploads.RANGE_SIZE', 1024)
+    def test_pool_matches_sequential(self, _):
+        sequential_stats, pooled_stats = Counter(), Counter()
+        sequential = list(iter_csv_file_rows(self.path, workers=1, stats=sequential_stats))
+        pooled = list(iter_csv_file_rows(self.path, workers=3, stats=pooled_stats))
+        self.assertEqual(pooled, sequential)
+        self.assertEqual(pooled_stats, sequential_stats)
+        self.assertEqual(sequential_stats['rows_read'], 200)
+        self.assertGreater(sequential_stats['rows_skipped'], 0)
+
+
+class CopyLoaderTests(TestCase):
+    def test_empty_numeric_cells_get_model_defaults(self):
+        row = dict.fromkeys(CSV_FIELDNAMES, '')
+        row.update({
+            'name': 'Аспирин', 'serial': 'A1', 'expiry_date': '05.03.2027', 'category': 'Прочее',
+            'import_date': '01.01.2026', 'internal_code': '1', 'wholesale_price': '9,00',
+            'distributor': 'd', 'internal_id': '1',
+        })
+        values = normalize_row(row)
+        missing = {key: value for key, value in normalize_row(dict(row, serial='A2')).items() if key != 'total_price'}
+        with suppress_index_signals():
+            pharmacy = Pharmacy.objects.create(name='Тест', pharmacy_number='1', city='Минск')
+            self.assertEqual(copy_products(pharmacy, [values, missing]), 2)
+        products = Product.objects.filter(pharmacy=pharmacy).order_by('serial')
+        self.assertEqual(
+            list(products.values_list('serial', 'price', 'quantity', 'total_price', 'retail_price')),
+            [('A1', 0, 0, 0, 0), ('A2', 0, 0, 0, 0)],
+        )
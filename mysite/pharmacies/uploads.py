@@ -0,0 +1,215 @@
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from chardet.universaldetector import UniversalDetector
+from django.conf import settings
+
+from .normalization import CSV_FIELDNAMES, dedupe_rows, normalize_rows
+
+# Кодировку определяем по началу файла, а не по всему содержимому
+ENCODING_SAMPLE_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+# Диапазон байт, который разбирает один процесс пула за раз
+RANGE_SIZE = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class StagedUpload:
+    path: str
+    checksum: str
+    encoding: str
+    size: int
+
+
+def _upload_dir():
+    return os.path.abspath(settings.CSV_UPLOAD_DIR)
+
+
+def stage_upload(uploaded_file):
+    """Потоково сохраняет загруженный файл в temp_csv, считая sha256 и кодировку"""
+    upload_dir = _upload_dir()
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.csv")
+    partial_path = f"{path}.part"
+
+    digest = hashlib.sha256()
+    detector = UniversalDetector()
+    sampled = 0
+    size = 0
+
+    try:
+        with open(partial_path, 'wb') as out:
+            for chunk in uploaded_file.chunks():
+                out.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+                if sampled < ENCODING_SAMPLE_SIZE and not detector.done:
+                    sample = chunk[:ENCODING_SAMPLE_SIZE - sampled]
+                    detector.feed(sample)
+                    sampled += len(sample)
+        os.replace(partial_path, path)
+    except Exception:
+        discard_staged(partial_path)
+        raise
+
+    return StagedUpload(path=path, checksum=digest.hexdigest(), encoding=_detected_encoding(detector), size=size)
+
+
+def _detected_encoding(detector):
+    detector.close()
+    encoding = detector.result.get('encoding') or 'utf-8'
+    # ASCII-префикс ничего не говорит о кириллице дальше в файле
+    if encoding.lower() == 'ascii':
+        encoding = 'utf-8'
+    return encoding
+
+
+def detect_file_encoding(path):
+    """Кодировка файла по первым ENCODING_SAMPLE_SIZE байтам"""
+    detector = UniversalDetector()
+    with open(path, 'rb') as f:
+        detector.feed(f.read(ENCODING_SAMPLE_SIZE))
+    return _detected_encoding(detector)
+
+
+def resolve_staged_path(path):
+    """Проверяет, что путь указывает внутрь каталога temp_csv"""
+    upload_dir = _upload_dir()
+    resolved = os.path.abspath(path)
+    if os.path.commonpath([upload_dir, resolved]) != upload_dir:
+        raise ValueError(f"Staged file outside of upload dir: {path}")
+    if not os.path.isfile(resolved):
+        raise FileNotFoundError(f"Staged file not found: {path}")
+    return resolved
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_staged(path, checksum=None):
+    resolved = resolve_staged_path(path)
+    if checksum and file_checksum(resolved) != checksum:
+        raise ValueError(f"Checksum mismatch for staged file: {path}")
+    return resolved
+
+
+def open_staged_csv(path, checksum=None, encoding='utf-8'):
+    """Открывает сохранённый CSV для построчного чтения, сверяя контрольную сумму"""
+    return open(verify_staged(path, checksum), encoding=encoding, newline='')
+
+
+def _splits_on_newline(encoding):
+    # В UTF-16/32 байт 0x0A не обязательно конец строки
+    try:
+        return '\n'.encode(encoding) == b'\n'
+    except LookupError:
+        return False
+
+
+def split_ranges(path, parts):
+    """Делит файл на диапазоны байт [start, end), каждый начинается с новой строки"""
+    size = os.path.getsize(path)
+    if parts <= 1 or size == 0:
+        return [(0, size)]
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            target = size * i // parts
+            if target <= bounds[-1]:
+                continue
+            f.seek(target)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def parse_range(path, encoding, start, end):
+    """Нормализует строки из диапазона байт файла (выполняется в дочернем процессе)"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    reader = csv.DictReader(
+        io.StringIO(data.decode(encoding), newline=''),
+        fieldnames=CSV_FIELDNAMES, delimiter=';'
+    )
+    stats = Counter()
+    return list(normalize_rows(reader, stats)), stats
+
+
+def _in_daemon_process():
+    # Дочерний процесс prefork-воркера Celery — демон billiard, своих детей ему заводить нельзя
+    if multiprocessing.current_process().daemon:
+        return True
+    from billiard.process import current_process
+    return bool(current_process().daemon)
+
+
+def _parsed_ranges(pool, path, encoding, ranges, window):
+    """Результаты диапазонов по порядку; в работе не больше window диапазонов"""
+    pending = deque()
+    for start, end in ranges:
+        pending.append(pool.submit(parse_range, path, encoding, start, end))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _merge_ranges(results, stats):
+    for rows, range_stats in results:
+        stats.update(range_stats)
+        yield from rows
+
+
+def iter_csv_file_rows(path, encoding='utf-8', workers=1, stats=None):
+    """
+    Нормализованные строки CSV-файла без дубликатов.
+    При workers > 1 файл делится по границам строк на диапазоны до
+    RANGE_SIZE байт и разбирается в пуле процессов; в памяти родителя не
+    больше двух диапазонов на процесс, результаты склеиваются в исходном
+    порядке, так что правило дубликатов (первая строка побеждает) не меняется.
+    Внутри prefork-воркера Celery пул не создаётся, файл читается построчно.
+    Поля CSV с переводом строки внутри кавычек выгрузки аптек не содержат.
+    """
+    stats = stats if stats is not None else Counter()
+    if workers <= 1 or not _splits_on_newline(encoding) or _in_daemon_process():
+        with open(path, encoding=encoding, newline='') as f:
+            reader = csv.DictReader(f, fieldnames=CSV_FIELDNAMES, delimiter=';')
+            yield from dedupe_rows(normalize_rows(reader, stats), stats)
+        return
+
+    ranges = split_ranges(path, max(workers, -(-os.path.getsize(path) // RANGE_SIZE)))
+    # fork: дочерним процессам достаются уже настроенные Django и кеш форм
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=multiprocessing.get_context('fork')) as pool:
+        results = _parsed_ranges(pool, path, encoding, ranges, window=2 * workers)
+        yield from dedupe_rows(_merge_ranges(results, stats), stats)
+
+
+def iter_staged_rows(path, checksum=None, encoding='utf-8', workers=1, stats=None):
+    """То же для файла из temp_csv, со сверкой контрольной суммы"""
+    resolved = verify_staged(path, checksum)
+    yield from iter_csv_file_rows(resolved, encoding=encoding, workers=workers, stats=stats)
+
+
+def discard_staged(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,12 +1,13 @@
 from elasticsearch.helpers import bulk
 from django_elasticsearch_dsl.registries import connections
 from .documents import ProductDocument
-from elasticsearch import Elasticsearch
+from django.conf import settings
+from .elastic import get_client
 
 def bulk_index_products(product_instances):
-    es = Elasticsearch(hosts=["http://elasticsearch-node-2:9200", "http://elasticsearch-node-1:9200"])  # Подключение к Elasticsearch
+    es = get_client()  # Общий клиент процесса
     actions = [
         ProductDocument().get_index_action(product)
         for product in product_instances
     ]
-    bulk(client=es, actions=actions)
+    bulk(client=es, actions=actions, request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT)
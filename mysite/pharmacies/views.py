@@ -1,4 +1,5 @@
-from django.core.paginator import Paginator
+import logging
+
 from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 # Create your views here.
@@ -6,21 +7,24 @@ from django.shortcuts import render
 
 from .forms import ProductSearchForm
 from .models import Pharmacy, Product
+from .result_cache import cached_result
+from .search_service import (
+    GROUPS_PAGE_SIZE, OFFERS_CURSOR_KEYS, PRODUCTS_CURSOR_KEYS, PRODUCTS_PAGE_SIZE, decode_after,
+    product_groups, product_offers, product_pages
+)
 
 
-from django.db.models import Count
+from django.db.models import Count, Min
 from django.core.cache import cache
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.contrib.postgres.search import SearchQuery
 from django.db.models import Q
-from django.db.models import Func, Value
 
 
 
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import connections
+from elasticsearch.exceptions import TransportError
+
 
-# Подключение к Elasticsearch
-es = Elasticsearch(hosts=["http://elasticsearch-node-1:9200"])
+logger = logging.getLogger(__name__)
 
 
 
@@ -41,58 +45,33 @@ def index(request):
 
     unique_cities = [{'city': c, 'is_selected': (c == city)} for c in unique_cities]
 
-    # Оптимизация запросов к базе данных
-    products = Product.objects.select_related('pharmacy')
-
-    if query:
-        # Используем Elasticsearch для поиска по названию
-        body = {
-            "query": {
-                "bool": {
-                    "must": [  # Обе части запроса должны быть выполнены
-                        {
-                            "multi_match": {
-                                "query": query,  # Запрос, состоящий из двух слов
-                                "fields": ["name"],  # Поле, в котором осуществляется поиск
-                                "type": "bool_prefix",  # Использовать лучшее совпадение
-                                "fuzziness": "AUTO",  # Автоматический уровень нечеткости
-                                "operator": "and"  # Условие "и" для всех слов
-                            }
-                        }
-                    ],
-
-                }
-            },
-            "sort": [{"price": {"order": "asc"}}]
-        }
-
-        # Выполняем запрос в Elasticsearch
-        response = es.search(index="products", body=body)
-
-        # Получаем IDs продуктов из результатов Elasticsearch
-        elastic_ids = [hit["_id"] for hit in response["hits"]["hits"]]
-
-        # Фильтруем продукты в Django по ID
-        products = products.filter(uuid__in=elastic_ids)
-
-    if city:
-        products = products.filter(pharmacy__city__iexact=city)  # Фильтр по городу
-
-    # Группировка продуктов на уровне базы данных
-    grouped_products = (
-        products.values('name', 'pharmacy__city')
-        .annotate(count=Count('uuid'))
-        .order_by('name', 'pharmacy__city', 'price')
-    )
-
-    # Пагинация (10 записей на страницу)
-    paginated_products = Paginator(grouped_products, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginated_products.get_page(page_number)
+    after = request.GET.get('after', '')
+    try:
+        # Группы «название x город», число товаров и минимальная цена — одним запросом к ES;
+        # следующая страница — по after_key, без COUNT и без выборки из Postgres
+        page_obj, next_after = cached_result(
+            'index', lambda: product_groups(query, city, after=decode_after(after)),
+            query=query, city=city, page=after,
+        )
+    except TransportError as e:
+        # ES недоступен — первая страница групп из базы по простому совпадению названия
+        logger.error(f"Elasticsearch search failed: {e}")
+        products = Product.objects.live()
+        if query:
+            products = products.filter(name__icontains=query)
+        if city:
+            products = products.filter(pharmacy__city__iexact=city)
+        page_obj = list(
+            products.values('name', 'pharmacy__city')
+            .annotate(count=Count('uuid'), min_price=Min('price'))
+            .order_by('name', 'pharmacy__city')[:GROUPS_PAGE_SIZE]
+        )
+        next_after = ''
 
     return render(request, 'pharmacies/index.html', {
         'form': form,
         'page_obj': page_obj,
+        'next_after': next_after,
         'unique_cities': unique_cities,
         'query': query,
         'city': city,
@@ -100,92 +79,31 @@ def index(request):
 
 
 def search_products(request):
-    name_query = request.GET.get('name', '').strip()
+    name_text = request.GET.get('name', '').strip()
     city_query = request.GET.get('city', '').strip()
 
-    body = {
-        "query": {
-            "bool": {
-                "must": [],
-                "filter": []
-            }
-        }
-    }
-
-    if name_query:
-        body["query"]["bool"]["must"].append({
-            "multi_match": {
-                "query": name_query,
-                "fields": ["name"],
-                "type": "bool_prefix",
-                "fuzziness": "AUTO",
-                "operator": "and"
-            }
-        })
-
-    if city_query:
-        body["query"]["bool"]["filter"].append({
-            "match": {
-                "pharmacy.city": city_query  # Фильтрация по точному совпадению
-            }
-        })
-
-    body["_source"] = [
-        'name',
-        'form',
-        'manufacturer',
-        'country',
-        'price',
-        'quantity',
-        'pharmacy.city',
-        'pharmacy.name'
-    ]
-
+    after = request.GET.get('after', '')
     try:
-        response = es.search(index="products", body=body)
-        print(f"Elasticsearch response: {response}")
-    except Exception as e:
-        print(f"Ошибка запроса к Elasticsearch: {e}")
-        return render(request, 'pharmacies/error.html', {'message': 'Ошибка поиска'})
-
-    grouped_products = {}
-
-    for hit in response["hits"]["hits"]:
-        product = hit["_source"]
-        pharmacy_city = product.get("pharmacy", {}).get("city", "Unknown")
-        pharmacy_name = product.get("pharmacy", {}).get("name", "Unknown")
-
-        key = (
-            product.get("name", "N/A"),
-            product.get("form", "N/A"),
-            product.get("manufacturer", "N/A"),
-            product.get("country", "N/A")
+        # Группировка по товару и аптеки внутри — в ES; страницы по after_key composite-агрегации
+        page_obj, next_after = cached_result(
+            'search_products',
+            lambda: product_pages(name_text, city_query, after=decode_after(after, keys=PRODUCTS_CURSOR_KEYS)),
+            query=name_text, city=city_query, page=after,
         )
-
-        # Если группы ещё нет — создаём
-        if key not in grouped_products:
-            grouped_products[key] = {
-                "name": product.get("name", "N/A"),
-                "form": product.get("form", "N/A"),
-                "manufacturer": product.get("manufacturer", "N/A"),
-                "country": product.get("country", "N/A"),
-                "pharmacies": []  # список аптек для этого товара
-            }
-
-        # Добавляем аптеку в список
-        grouped_products[key]["pharmacies"].append({
-            "pharmacy_city": pharmacy_city,
-            "pharmacy_name": pharmacy_name,
-            "price": product.get("price"),
-            "quantity": product.get("quantity"),
-        })
-
-    # Преобразуем в список для пагинации
-    grouped_products_list = list(grouped_products.values())
-
-    paginator = Paginator(grouped_products_list, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    except TransportError as e:
+        # ES недоступен — первая страница товаров из базы по простому совпадению названия
+        logger.error(f"Elasticsearch search failed: {e}")
+        products = Product.objects.live()
+        if name_text:
+            products = products.filter(name__icontains=name_text)
+        if city_query:
+            products = products.filter(pharmacy__city__iexact=city_query)
+        page_obj = list(
+            products.values('name', 'form', 'manufacturer', 'country')
+            .distinct()
+            .order_by('name', 'form', 'manufacturer', 'country')[:PRODUCTS_PAGE_SIZE]
+        )
+        next_after = ''
 
     unique_cities = Pharmacy.objects.values('city').distinct().order_by('city')
     for city_obj in unique_cities:
@@ -193,8 +111,9 @@ def search_products(request):
 
     return render(request, 'pharmacies/search_products_results.html', {
         'grouped_products': page_obj,
+        'next_after': next_after,
         'unique_cities': unique_cities,
-        'query': name_query,
+        'query': name_text,
         'city_query': city_query,
     })
 
@@ -207,11 +126,15 @@ def search_pharmacies(request):
     if name and form:
         # Filter products by name, form, and pharmacy city
 
-        pharmacies = Product.objects.filter(
-            name__iexact=name,
-            form__iexact=form,
-            pharmacy__city__exact=city  # Add city filtering
-        ).select_related('pharmacy')
+        pharmacies = cached_result(
+            'search_pharmacies',
+            lambda: list(Product.objects.live().filter(
+                name__iexact=name,
+                form__iexact=form,
+                pharmacy__city__exact=city  # Add city filtering
+            ).select_related('pharmacy')),
+            query=name, city=city, form=form,
+        )
 
     return render(request, 'pharmacies/search_pharmacies.html', {
         'pharmacies': pharmacies,
@@ -227,67 +150,27 @@ def search(request):
     form_query = request.GET.get('form', '').strip()  # Filter by form
 
     # Filter products dynamically based on user input
-    products = Product.objects.select_related('pharmacy').all().order_by('price')
+    products = Product.objects.live()
 
     if query:
-        search_vector = SearchVector('name', config='russian')
+        # Stored search_vector (GIN) and a pg_trgm index on UPPER(name) serve both
+        # branches, see the setup_name_search command
         search_query = SearchQuery(query, config='russian')
-        products = products.annotate(search=search_vector).filter(
-            Q(search=search_query) | Q(name__icontains=query)
-        )
+        products = products.filter(Q(search_vector=search_query) | Q(name__icontains=query))
     #
     if form_query:
         products = products.filter(form__iexact=form_query)
     if city and city != 'Все города':  # Skip filtering if "Все города" is selected
         products = products.filter(pharmacy__city__iexact=city)
 
-    # Group products by name, form, pharmacy name, city, and pharmacy number while summing quantities
-    grouped_products = {}
-    for product in products:
-        key = (
-            product.name,
-            product.form,
-            product.pharmacy.name if product.pharmacy else 'Unknown',
-            product.pharmacy.city if product.pharmacy else 'Unknown',
-            product.pharmacy.pharmacy_number if product.pharmacy else 'N/A'  # Include pharmacy number in key
-        )
-        if key not in grouped_products:
-            grouped_products[key] = {
-                'name': product.name,
-                'form': product.form,
-                'pharmacy_name': product.pharmacy.name if product.pharmacy else 'Unknown',
-                'pharmacy_city': product.pharmacy.city if product.pharmacy else 'Unknown',
-                'pharmacy_address': product.pharmacy.address if product.pharmacy else 'Unknown',
-                'pharmacy_phone': product.pharmacy.phone if product.pharmacy else 'Unknown',
-                'pharmacy_number': product.pharmacy.pharmacy_number if product.pharmacy else 'N/A',
-                'price': product.price,
-                'quantity': product.quantity,
-                'manufacturer': product.manufacturer,
-                'country': product.country,
-                'pharmacies': [],
-                'updated_at': product.updated_at, 
-            }
-        else:
-            
-            if product.updated_at > grouped_products[key]['updated_at']:
-                grouped_products[key]['updated_at'] = product.updated_at
-            # Sum the quantities for the same product and pharmacy
-            grouped_products[key]['quantity'] += product.quantity
-
-        # Add pharmacy details to the pharmacies list
-        grouped_products[key]['pharmacies'].append({
-            'pharmacy_name': product.pharmacy.name,
-            'pharmacy_number': product.pharmacy.pharmacy_number,
-            'pharmacy_city': product.pharmacy.city,
-            'pharmacy_address': product.pharmacy.address,
-            'pharmacy_phone': product.pharmacy.phone,
-        })
-
-    # Convert grouped products to a list for pagination
-    grouped_products_list = list(grouped_products.values())
-    paginator = Paginator(grouped_products_list, 50)  # Paginate 20 items per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Group by name, form and pharmacy in SQL (min price, total quantity, last update);
+    # pages are fetched by the key of the last group, without COUNT
+    after = request.GET.get('after', '')
+    page_obj, next_after = cached_result(
+        'search',
+        lambda: product_offers(products, after=decode_after(after, keys=OFFERS_CURSOR_KEYS)),
+        query=query, city=city, form=form_query, page=after,
+    )
 
     # Fetch unique cities for the dropdown
     unique_cities = Pharmacy.objects.values('city').distinct().order_by('city')
@@ -299,11 +182,12 @@ def search(request):
     for form_obj in unique_forms:
         form_obj['is_selected'] = (form_obj['form'] == form_query)
 
-    first_product = grouped_products_list[0] if grouped_products_list else None
+    first_product = page_obj[0] if page_obj else None
 
     # Render the search results template
     return render(request, 'pharmacies/search_with_results.html', {
         'page_obj': page_obj,
+        'next_after': next_after,
         'unique_cities': unique_cities,
         'unique_forms': unique_forms,
         'query': query,